@@ -0,0 +1,53 @@
+# ----------------------------
+# AGENT REGISTRY
+# ----------------------------
+class AgentRegistry:
+    """Telegram user ID -> display name of everyone who has posted an update.
+
+    remember() runs for every message but only marks the registry dirty
+    when an ID is new or its name changed, so the store's flush rewrites
+    agents.json only after a real change. IDs are ints in memory and
+    strings in the file.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self.dirty = False
+
+    def load(self, data: dict):
+        self._names = {int(uid): name for uid, name in data.items()}
+        self.dirty = False
+
+    def dump(self) -> dict:
+        return {str(uid): name for uid, name in self._names.items()}
+
+    def remember(self, user_id: int, name: str) -> bool:
+        """Record the user's current name; True if anything changed."""
+        if self._names.get(user_id) == name:
+            return False
+        self._names[user_id] = name
+        self.dirty = True
+        return True
+
+    def name(self, user_id: int, default: str = None) -> str:
+        return self._names.get(user_id, default)
+
+    def unique_names(self) -> dict:
+        """name -> user ID for names only one user goes by."""
+        ids = {}
+        for uid, name in self._names.items():
+            ids[name] = None if name in ids else uid
+        return {name: uid for name, uid in ids.items() if uid is not None}
+
+    def clear(self):
+        self._names = {}
+        self.dirty = True
+
+    def items(self):
+        return self._names.items()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._names
+
+    def __len__(self) -> int:
+        return len(self._names)
@@ -0,0 +1,108 @@
+from config import STATUS_MAP
+
+
+# ----------------------------
+# LATENCY HISTOGRAM
+# ----------------------------
+class LatencyHistogram:
+    """Counts of durations in log-linear buckets, HDR-histogram style.
+
+    Durations below 2**precision seconds get a bucket each; above that every
+    power of two is split into 2**(precision - 1) equal buckets, so a
+    percentile is off by at most 1 / 2**(precision - 1) of its value and a
+    histogram never holds more than a few hundred counters however many
+    durations it has seen.
+    """
+
+    def __init__(self, precision: int = 5):
+        self.precision = precision
+        self.half = 1 << (precision - 1)
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def _bucket(self, value: int) -> int:
+        shift = max(value.bit_length() - self.precision, 0)
+        return shift * self.half + (value >> shift)
+
+    def _midpoint(self, bucket: int) -> float:
+        if bucket < 2 * self.half:
+            return bucket
+        shift = bucket // self.half - 1
+        low = (bucket - shift * self.half) << shift
+        return low + ((1 << shift) - 1) / 2
+
+    def add(self, seconds: float):
+        value = max(int(seconds), 0)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """The duration below which `p` percent of the recorded ones fall."""
+        if not self.total:
+            return 0
+        rank = max(1, -(-self.total * p // 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._midpoint(bucket), self.max)
+        return self.max
+
+
+# ----------------------------
+# TIME IN STATUS
+# ----------------------------
+class LatencyStats:
+    """How long orders sit in a status before their next update.
+
+    Fed with every status change; each change adds the time since the
+    order's previous history entry to the histogram of the (previous
+    status, new status) pair and to that of the agent who made the
+    change. Changes out of done (only an /undone does that) and repeats of
+    the same status are not delivery legs and are left out.
+    """
+
+    def __init__(self):
+        self.by_pair = {}
+        self.by_agent = {}
+
+    def clear(self):
+        self.by_pair = {}
+        self.by_agent = {}
+
+    def observe(self, before: tuple, after: tuple):
+        """Record one change; both sides are (ts, status, agent)."""
+        ts_from, status_from, _ = before
+        ts_to, status_to, agent = after
+        if status_from == status_to or status_from == STATUS_MAP["done"]:
+            return
+        seconds = ts_to - ts_from
+        self.by_pair.setdefault((status_from, status_to), LatencyHistogram()).add(seconds)
+        self.by_agent.setdefault(agent, LatencyHistogram()).add(seconds)
+
+    @staticmethod
+    def _percentiles(histograms: dict) -> dict:
+        return {
+            key: {"count": h.total, "p50": h.percentile(50), "p95": h.percentile(95), "p99": h.percentile(99)}
+            for key, h in histograms.items()
+        }
+
+    def pairs(self) -> dict:
+        """{(from, to): {"count", "p50", "p95", "p99"}}, durations in seconds."""
+        return self._percentiles(self.by_pair)
+
+    def agents(self) -> dict:
+        """{agent: {"count", "p50", "p95", "p99"}}, durations in seconds."""
+        return self._percentiles(self.by_agent)
+
+
+def fmt_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    hours, minutes = divmod(round(seconds / 60), 60)
+    if not hours:
+        return f"{minutes}m"
+    return f"{hours}h{minutes:02d}m"
@@ -0,0 +1,97 @@
+import glob
+import json
+import mmap
+import os
+import zlib
+from datetime import date
+
+from store import read_json, write_json
+
+
+# ----------------------------
+# DAILY ARCHIVE
+# ----------------------------
+class OrderArchive:
+    """Finished days of orders, one compressed segment per day.
+
+    A day is written as `<date>.seg`, the orders compressed one by one and
+    concatenated, next to `<date>.idx`, a small JSON index holding each
+    order's (offset, length) and the day's totals. /report only reads
+    indexes; /history reads an index and then just the bytes of the
+    order it wants from the memory-mapped segment.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _base(self, day: date) -> str:
+        base = os.path.join(self.directory, day.isoformat())
+        candidate, n = base, 0
+        while os.path.exists(f"{candidate}.idx"):
+            n += 1
+            candidate = f"{base}.{n}"
+        return candidate
+
+    def roll(self, day: date, orders: dict, summary: dict, agents: dict):
+        """Write one day's orders and totals as a new segment."""
+        if not orders:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        base = self._base(day)
+
+        offsets = {}
+        tmp = f"{base}.seg.tmp"
+        with open(tmp, "wb") as f:
+            for oid, info in orders.items():
+                blob = zlib.compress(json.dumps(info, separators=(",", ":")).encode())
+                offsets[oid] = [f.tell(), len(blob)]
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, f"{base}.seg")
+
+        write_json(f"{base}.idx", {"day": day.isoformat(), "summary": summary, "agents": agents, "orders": offsets})
+
+    def _indexes(self, start: date = None, end: date = None) -> list:
+        """(day, index path) pairs in date order, limited to [start, end]."""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, "*.idx")):
+            name = os.path.basename(path)[:-4]
+            try:
+                day = date.fromisoformat(name[:10])
+                part = int(name[11:] or 0)
+            except ValueError:
+                continue
+            if (start is None or day >= start) and (end is None or day <= end):
+                found.append((day, part, path))
+        return [(day, path) for day, _, path in sorted(found)]
+
+    def lookup(self, oid: str, start: date = None, end: date = None) -> list:
+        """Every archived copy of an order as (day, info), oldest first."""
+        results = []
+        for day, path in self._indexes(start, end):
+            entry = read_json(path).get("orders", {}).get(oid)
+            if entry is None:
+                continue
+            offset, length = entry
+            with open(path[:-4] + ".seg", "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                results.append((day, json.loads(zlib.decompress(m[offset:offset + length]))))
+        return results
+
+    def report(self, start: date, end: date) -> dict:
+        """Totals per day and per agent over [start, end], from the indexes alone."""
+        keys = ("total", "done", "no_answer", "in_progress")
+        days = {}
+        totals = dict.fromkeys(keys, 0)
+        agents = {}
+        for day, path in self._indexes(start, end):
+            index = read_json(path)
+            per_day = days.setdefault(day, dict.fromkeys(keys, 0))
+            for key in keys:
+                per_day[key] += index["summary"].get(key, 0)
+                totals[key] += index["summary"].get(key, 0)
+            for agent, counts in index.get("agents", {}).items():
+                entry = agents.setdefault(agent, {"total": 0, "done": 0})
+                entry["total"] += counts.get("total", 0)
+                entry["done"] += counts.get("done", 0)
+        return {"days": list(days.items()), "totals": totals, "agents": agents}
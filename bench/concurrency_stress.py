@@ -0,0 +1,187 @@
+"""Fire thousands of concurrent updates through the real handlers and check nothing is lost.
+
+    python bench/concurrency_stress.py [updates] [--backend sqlite|journal|json]
+
+Every update runs as its own task, like with concurrent_updates enabled.
+Afterwards the store must hold exactly one history entry per order the
+handlers reported as updated, the same after a reload from disk, and
+every /done entry must belong to the agent who held the order just
+before it. SQLite is the default because its find() really yields to
+the event loop, which is where a stale /done would slip through.
+
+A few updates are delivered twice, like a webhook retry would; no
+message may update the same order more than once.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bot  # noqa: E402
+from config import ADMINS, GROUP_ID, STATUS_MAP  # noqa: E402
+from store import open_store, unpack_entry  # noqa: E402
+
+AGENTS = [(1000 + i, f"Agent {i}") for i in range(12)]
+WORDS = ["out", "otw", "got", "no", "air"]
+MESSAGE_IDS = itertools.count(1)
+
+
+# ----------------------------
+# FAKE TELEGRAM OBJECTS
+# ----------------------------
+class FakeBot:
+    def __init__(self):
+        self.next_id = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return self._sent(chat_id)
+
+    async def delete_messages(self, chat_id, message_ids):
+        pass
+
+    def _sent(self, chat_id):
+        self.next_id += 1
+        return SimpleNamespace(chat_id=chat_id, message_id=self.next_id)
+
+
+def fake_update(fake_bot, text: str, user_id: int, name: str):
+    async def reply_text(reply, parse_mode=None, **kwargs):
+        await asyncio.sleep(0)
+        return fake_bot._sent(GROUP_ID)
+
+    message = SimpleNamespace(
+        message_id=next(MESSAGE_IDS),
+        text=text,
+        chat=SimpleNamespace(id=GROUP_ID),
+        from_user=SimpleNamespace(id=user_id, full_name=name),
+        reply_to_message=None,
+        reply_text=reply_text,
+    )
+    return SimpleNamespace(message=message, effective_chat=message.chat, effective_user=message.from_user)
+
+
+# ----------------------------
+# WORKLOAD
+# ----------------------------
+def workload(size: int, orders: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    items = []
+    for _ in range(size):
+        shape = rng.random()
+        user_id, name = rng.choice(AGENTS)
+        if shape < 0.8:
+            ids = "/".join(str(rng.randint(1, orders)) for _ in range(rng.randint(1, 3)))
+            items.append(("listener", f"{ids} {rng.choice(WORDS)}", user_id, name))
+        elif shape < 0.97:
+            items.append(("done", "/done", user_id, name))
+        else:
+            items.append(("undone", f"/undone {rng.randint(1, orders)}", ADMINS[0], "Admin"))
+    return items
+
+
+def redeliver(updates: list, share: float = 0.05, seed: int = 12) -> list:
+    """The same updates with `share` of them sent a second time, at random positions."""
+    rng = random.Random(seed)
+    updates = list(updates)
+    for _ in range(int(len(updates) * share)):
+        updates.insert(rng.randrange(len(updates) + 1), rng.choice(updates))
+    return updates
+
+
+async def run(size: int, backend: str) -> list:
+    workdir = tempfile.mkdtemp(prefix="concurrency_stress_")
+
+    def open_fresh():
+        return open_store(
+            backend, os.path.join(workdir, "orders.json"), os.path.join(workdir, "agents.json"),
+            journal_file=os.path.join(workdir, "orders.journal"),
+            snapshot_file=os.path.join(workdir, "orders.snapshot.json"),
+            compact_every=200, db_file=os.path.join(workdir, "orders.db"),
+        )
+
+    branch = bot.branches.for_chat(GROUP_ID)
+    store = branch.store = open_fresh()
+    store.load()
+
+    reported = {}
+    applied = {}
+    apply_status = store.apply_status
+
+    def counting_apply_status(ids, status_full, agent_name, **kwargs):
+        updated = apply_status(ids, status_full, agent_name, **kwargs)
+        for oid in updated:
+            reported[oid] = reported.get(oid, 0) + 1
+            key = (kwargs.get("msg"), oid)
+            applied[key] = applied.get(key, 0) + 1
+        return updated
+
+    store.apply_status = counting_apply_status
+
+    fake_bot = FakeBot()
+    context = SimpleNamespace(bot=fake_bot)
+    handlers = {"listener": bot.group_listener, "done": bot.done_command, "undone": bot.undone}
+    items = redeliver(
+        (handlers[kind], fake_update(fake_bot, text, user_id, name))
+        for kind, text, user_id, name in workload(size, orders=max(size // 20, 10))
+    )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(update, context) for handler, update in items))
+    elapsed = time.perf_counter() - started
+    await branch.notifier.stop()
+    print(f"{len(items)} concurrent updates in {elapsed:.2f}s ({backend})")
+
+    problems = []
+    for (msg, oid), count in applied.items():
+        if msg is not None and count > 1:
+            problems.append(f"{oid}: message {msg} applied {count} times")
+    for oid, info in store.items():
+        history = [unpack_entry(h) for h in info["history"]]
+        if len(history) != reported.get(oid, 0):
+            problems.append(f"{oid}: {len(history)} history entries, {reported.get(oid, 0)} updates reported")
+        seqs = [seq for seq, _, _, _ in history]
+        if seqs != sorted(set(seqs)):
+            problems.append(f"{oid}: history out of order")
+        for (_, _, _, before), (_, _, status, agent) in zip(history, history[1:]):
+            if status == STATUS_MAP["done"] and agent != before:
+                problems.append(f"{oid}: {agent} marked done an order held by {before}")
+    try:
+        store.stats.verify(store.orders)
+    except AssertionError as e:
+        problems.append(f"counters drifted: {e}")
+
+    in_memory = {oid: info["history"] for oid, info in store.items()}
+    store.close()
+    reloaded = open_fresh()
+    reloaded.load()
+    if {oid: info["history"] for oid, info in reloaded.items()} != in_memory:
+        problems.append("history after reload differs from memory")
+    reloaded.close()
+    return problems
+
+
+# ----------------------------
+# MAIN
+# ----------------------------
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("updates", type=int, nargs="?", default=5000)
+    parser.add_argument("--backend", choices=("sqlite", "journal", "json"), default="sqlite")
+    args = parser.parse_args()
+
+    problems = asyncio.run(run(args.updates, args.backend))
+    for problem in problems[:20]:
+        print("PROBLEM", problem)
+    print(f"{len(problems)} problems")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
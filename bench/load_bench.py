@@ -0,0 +1,465 @@
+"""Drive the real handlers with synthetic or recorded traffic and measure the bot.
+
+    python bench/load_bench.py synth [--updates N] [--rate R] [--orders N] [--preload N] [--save log.jsonl]
+    python bench/load_bench.py replay log.jsonl [--speed X]
+    python bench/load_bench.py compare baseline.json result.json
+
+Both run modes take --backend, --concurrency and --out result.json.
+
+Every message becomes a real telegram.Update and is handled by the first
+matching handler from bot.add_handlers(), like the Application would,
+with `--concurrency` updates in flight (CONCURRENT_UPDATES by default).
+Outbound Telegram calls go to a fake bot that records them. Stores live
+in a temporary directory, one per group chat in the traffic.
+
+The report covers:
+- throughput
+- handler latency p50/p99, overall and per handler
+- time updates waited in the queue
+- startup time (bot.on_startup(), which loads the preloaded stores) and
+  shutdown time (draining outgoing messages and flushing the stores)
+- bytes written (write syscalls from /proc/self/io, else the growth of the data directory)
+- peak RSS
+- outbound calls
+
+Save it with --out and diff two runs with `compare` to check a storage or
+parser change against a baseline.
+
+A message log is JSON lines, one message per line:
+
+    {"t": 12.5, "chat": -1002631348221, "user": 1001, "name": "Agent 1", "id": 77,
+     "text": "123/45 otw", "reply_to": "123/45", "edited": false}
+
+`t` is seconds from the start of the log. `reply_to` and `edited` are
+optional, and `chat` equal to `user` is a private chat. Lines holding a raw
+Telegram update (with "update_id") are replayed as they are, so updates
+captured from the webhook can be used. `synth --save` writes a log of the
+synthetic traffic.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, MessageEntity, Update, User  # noqa: E402
+
+import bot  # noqa: E402
+from branches import Branches  # noqa: E402
+from config import (  # noqa: E402
+    ADMINS, AGENT_LOG_CHANNEL, CONCURRENT_UPDATES, FLUSH_INTERVAL_SECONDS, GROUP_ID, STATUS_CODES,
+)
+from store import open_store  # noqa: E402
+
+AGENTS = [(1000 + i, f"Agent {i}") for i in range(12)]
+WORDS = ["otw", "got", "no", "air", "done"]
+
+# Share of each kind of message in synthetic traffic.
+MIX = {
+    "bare": 0.25,     # "123/45"
+    "status": 0.45,   # "123/45 otw"
+    "reply": 0.10,    # "got" in reply to "123/45"
+    "done": 0.08,     # "done"
+    "status_cmd": 0.04,
+    "stats_cmd": 0.03,
+    "lookup": 0.05,   # "123" in private
+}
+
+
+# ----------------------------
+# FAKE TELEGRAM BOT
+# ----------------------------
+class RecordingBot:
+    """Stands in for telegram.Bot and counts calls and text bytes per method."""
+
+    username = "bench_bot"
+
+    def __init__(self):
+        self.calls = {}
+        self._next_id = 10 ** 9
+
+    def _record(self, method: str, text: str = ""):
+        entry = self.calls.setdefault(method, {"calls": 0, "bytes": 0})
+        entry["calls"] += 1
+        entry["bytes"] += len(text.encode())
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._record("send_message", text)
+        self._next_id += 1
+        return SimpleNamespace(chat_id=chat_id, message_id=self._next_id)
+
+    async def edit_message_text(self, text, **kwargs):
+        self._record("edit_message_text", text)
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        self._record("delete_messages")
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        self._record("pin_chat_message")
+
+
+class RecordingJobs:
+    """Stands in for the JobQueue; jobs are only recorded, the run drives flushes itself."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_daily(self, callback, **kwargs):
+        self.jobs.append(callback.__name__)
+
+    def run_repeating(self, callback, **kwargs):
+        self.jobs.append(callback.__name__)
+
+
+# ----------------------------
+# TRAFFIC
+# ----------------------------
+def synthesize(size: int, rate: float, orders: int, seed: int = 7) -> list:
+    """A message log of `size` messages, `rate` per second (0: all at once)."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX.items())
+    admin = ADMINS[0] if ADMINS else AGENTS[0][0]
+    log = []
+
+    def some_orders():
+        return "/".join(str(rng.randint(1, orders)) for _ in range(rng.randint(1, 3)))
+
+    for i in range(size):
+        kind = rng.choices(kinds, weights)[0]
+        user, name = rng.choice(AGENTS)
+        record = {"t": i / rate if rate else 0, "chat": GROUP_ID, "user": user, "name": name, "id": i + 1}
+        if kind == "bare":
+            record["text"] = some_orders()
+        elif kind == "status":
+            record["text"] = f"{some_orders()} {rng.choice(WORDS)}"
+        elif kind == "reply":
+            record.update(text=rng.choice(WORDS), reply_to=some_orders())
+        elif kind == "done":
+            record["text"] = "done"
+        elif kind == "lookup":
+            record.update(chat=user, text=str(rng.randint(1, orders)))
+        else:
+            record.update(user=admin, name="Admin", text="/status" if kind == "status_cmd" else "/stats")
+        log.append(record)
+    return log
+
+
+def read_log(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_log(path: str, log: list):
+    with open(path, "w") as f:
+        for record in log:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def chat_of(record: dict) -> int:
+    if "update_id" in record:
+        message = record.get("message") or record.get("edited_message") or {}
+        return message.get("chat", {}).get("id", 0)
+    return record["chat"]
+
+
+def to_update(record: dict, fake_bot, update_id: int) -> Update:
+    if "update_id" in record:
+        return Update.de_json(record, fake_bot)
+
+    now = datetime.now(timezone.utc)
+    chat = Chat(record["chat"], Chat.PRIVATE if record["chat"] == record["user"] else Chat.SUPERGROUP)
+    text = record["text"]
+    entities = None
+    if text.startswith("/"):
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))]
+    reply = Message(0, now, chat, text=record["reply_to"]) if record.get("reply_to") else None
+    message = Message(
+        record.get("id", update_id), now, chat,
+        from_user=User(record["user"], record["name"], False),
+        text=text, entities=entities, reply_to_message=reply,
+    )
+    message.set_bot(fake_bot)
+    if record.get("edited"):
+        return Update(update_id, edited_message=message)
+    return Update(update_id, message=message)
+
+
+# ----------------------------
+# SETUP
+# ----------------------------
+def open_branches(log: list, backend: str, workdir: str, preload: int):
+    """Point bot.branches at fresh stores for the log's groups, with `preload` orders on disk.
+
+    The stores are left unloaded; bot.on_startup() loads them.
+    """
+    groups = sorted({chat for chat in map(chat_of, log) if chat < 0}) or [GROUP_ID]
+    configs = [
+        {"name": str(i), "group_id": chat, "admins": ADMINS, "log_channel": AGENT_LOG_CHANNEL,
+         "data_dir": os.path.join(workdir, str(i))}
+        for i, chat in enumerate(groups)
+    ]
+    bot.branches = Branches(configs)
+
+    def open_fresh(branch):
+        def path(name):
+            return os.path.join(branch.data_dir, name)
+        return open_store(
+            backend, path("orders.json"), path("agents.json"),
+            journal_file=path("orders.journal"), snapshot_file=path("orders.snapshot.json"),
+            compact_every=500, db_file=path("orders.db"),
+            processed_file=path("processed.json"), processed=branch.store.processed,
+        )
+
+    rng = random.Random(3)
+    for branch in bot.branches:
+        branch.store = open_fresh(branch)
+        branch.load()
+        for start in range(1, preload + 1, 50):
+            user, name = rng.choice(AGENTS)
+            ids = [str(oid) for oid in range(start, min(start + 50, preload + 1))]
+            branch.store.apply_status(ids, rng.choice(STATUS_CODES[1:]), name, user)
+            branch.store.remember_agent(user, name)
+        branch.store.close()
+        branch.store = open_fresh(branch)
+
+
+def bytes_written() -> int:
+    """Bytes this process has passed to write calls so far, or None off Linux."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# ----------------------------
+# RUN
+# ----------------------------
+async def run(log: list, backend: str, preload: int, speed: float, concurrency: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="load_bench_")
+    try:
+        open_branches(log, backend, workdir, preload)
+        return await drive(log, workdir, speed, concurrency, backend, preload)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def drive(log, workdir, speed, concurrency, backend, preload) -> dict:
+    fake_bot = RecordingBot()
+    app = SimpleNamespace(bot=fake_bot, job_queue=RecordingJobs())
+    handlers = []
+    bot.add_handlers(SimpleNamespace(add_handler=handlers.append))
+    bot.metrics_server = None
+    bot.deleter.path = os.path.join(workdir, "pending_deletes.json")
+    user_data = {}
+
+    latencies = {}
+    waits = []
+    # Without pacing, a bounded queue keeps the feed just ahead of the workers.
+    queue = asyncio.Queue(maxsize=0 if speed else concurrency)
+
+    async def worker():
+        while (item := await queue.get()) is not None:
+            update, arrived = item
+            started = time.perf_counter()
+            waits.append(started - arrived)
+            for handler in handlers:
+                check = handler.check_update(update)
+                if check is not None and check is not False:
+                    break
+            else:
+                continue
+            user = update.effective_user.id if update.effective_user else 0
+            context = SimpleNamespace(bot=fake_bot, user_data=user_data.setdefault(user, {}))
+            await handler.callback(update, context)
+            latencies.setdefault(handler.callback.__name__, []).append(time.perf_counter() - started)
+
+    async def flusher():
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            await bot.flush_store(SimpleNamespace(bot=fake_bot))
+
+    written_before = bytes_written()
+    size_before = dir_size(workdir)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    await bot.on_startup(app)
+    load_seconds = time.perf_counter() - started
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    flush_task = asyncio.create_task(flusher())
+
+    started = time.perf_counter()
+    for update_id, record in enumerate(log, start=1):
+        if speed:
+            delay = started + record.get("t", 0) / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await queue.put((to_update(record, fake_bot, update_id), time.perf_counter()))
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - started
+
+    flush_task.cancel()
+    stopping = time.perf_counter()
+    await bot.on_stop(app)
+    await bot.on_shutdown(app)
+    shutdown_seconds = time.perf_counter() - stopping
+    written_after = bytes_written()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    every = [seconds for samples in latencies.values() for seconds in samples]
+    return {
+        "backend": backend,
+        "preload": preload,
+        "concurrency": concurrency,
+        "updates": len(log),
+        "handled": len(every),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(len(log) / elapsed, 1) if elapsed else 0.0,
+        "handler_p50_ms": round(percentile(every, 50) * 1000, 3),
+        "handler_p99_ms": round(percentile(every, 99) * 1000, 3),
+        "queue_wait_p99_ms": round(percentile(waits, 99) * 1000, 3),
+        "load_s": round(load_seconds, 4),
+        "shutdown_s": round(shutdown_seconds, 4),
+        "bytes_written": (written_after - written_before) if written_before is not None else dir_size(workdir) - size_before,
+        "data_dir_bytes": dir_size(workdir),
+        "peak_rss_kb": rss_after,
+        "rss_growth_kb": rss_after - rss_before,
+        "handlers": {
+            name: {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 50) * 1000, 3),
+                "p99_ms": round(percentile(samples, 99) * 1000, 3),
+            }
+            for name, samples in sorted(latencies.items())
+        },
+        "outbound": dict(sorted(fake_bot.calls.items())),
+    }
+
+
+# ----------------------------
+# REPORT
+# ----------------------------
+def report(result: dict):
+    print(
+        f"{result['updates']} updates in {result['elapsed_s']:.2f}s: {result['throughput_per_s']:.0f}/s "
+        f"({result['backend']}, {result['preload']} orders preloaded, concurrency {result['concurrency']})"
+    )
+    print(
+        f"handler p50 {result['handler_p50_ms']:.3f} ms, p99 {result['handler_p99_ms']:.3f} ms; "
+        f"queue wait p99 {result['queue_wait_p99_ms']:.3f} ms; "
+        f"startup {result['load_s'] * 1000:.1f} ms, shutdown {result['shutdown_s'] * 1000:.1f} ms"
+    )
+    for name, h in result["handlers"].items():
+        print(f"  {name:<18} {h['count']:>7}  p50 {h['p50_ms']:8.3f} ms  p99 {h['p99_ms']:8.3f} ms")
+    print(f"disk: {result['bytes_written'] / 1024:.1f} KB written, data dir {result['data_dir_bytes'] / 1024:.1f} KB")
+    print(f"memory: peak RSS {result['peak_rss_kb'] / 1024:.1f} MB (+{result['rss_growth_kb'] / 1024:.1f} MB during the run)")
+    for method, c in result["outbound"].items():
+        print(f"  {method:<18} {c['calls']:>7} calls  {c['bytes'] / 1024:8.1f} KB")
+
+
+# (key, True if higher is better)
+COMPARED = [
+    ("throughput_per_s", True),
+    ("handler_p50_ms", False),
+    ("handler_p99_ms", False),
+    ("queue_wait_p99_ms", False),
+    ("load_s", False),
+    ("shutdown_s", False),
+    ("bytes_written", False),
+    ("data_dir_bytes", False),
+    ("peak_rss_kb", False),
+]
+
+
+def compare(base: dict, new: dict):
+    for key, higher_is_better in COMPARED:
+        before, after = base.get(key), new.get(key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        mark = "" if abs(change) < 2 else (" better" if better else " worse")
+        print(f"{key:<20} {before:>14} -> {after:<14} {change:+7.1f}%{mark}")
+    for name in sorted(set(base.get("handlers", {})) & set(new.get("handlers", {}))):
+        before, after = base["handlers"][name]["p99_ms"], new["handlers"][name]["p99_ms"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"  {name:<18} p99 {before:>10} -> {after:<10} {change:+7.1f}%")
+
+
+# ----------------------------
+# MAIN
+# ----------------------------
+def main():
+    parser = argparse.ArgumentParser()
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    def run_options(sub):
+        sub.add_argument("--backend", choices=("json", "journal", "sqlite"), default="json")
+        sub.add_argument("--concurrency", type=int, default=CONCURRENT_UPDATES)
+        sub.add_argument("--preload", type=int, default=0, help="orders in each store before the run")
+        sub.add_argument("--out", help="write the result as JSON")
+
+    synth = modes.add_parser("synth", help="synthetic traffic")
+    synth.add_argument("--updates", type=int, default=5000)
+    synth.add_argument("--rate", type=float, default=0, help="updates per second (0: as fast as possible)")
+    synth.add_argument("--orders", type=int, default=500, help="order IDs the traffic picks from")
+    synth.add_argument("--save", help="also write the traffic as a message log")
+    run_options(synth)
+
+    replay = modes.add_parser("replay", help="replay a message log")
+    replay.add_argument("log")
+    replay.add_argument("--speed", type=float, default=0, help="1 = recorded pace, 10 = ten times faster, 0 = no waits")
+    run_options(replay)
+
+    diff = modes.add_parser("compare", help="compare two saved results")
+    diff.add_argument("baseline")
+    diff.add_argument("result")
+
+    args = parser.parse_args()
+    if args.mode == "compare":
+        with open(args.baseline) as a, open(args.result) as b:
+            return compare(json.load(a), json.load(b))
+
+    if args.mode == "synth":
+        log = synthesize(args.updates, args.rate, max(args.orders, 1))
+        speed = 1 if args.rate else 0
+        if args.save:
+            write_log(args.save, log)
+    else:
+        log = read_log(args.log)
+        speed = args.speed
+
+    result = asyncio.run(run(log, args.backend, args.preload, speed, max(args.concurrency, 1)))
+    report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Check parse_message() against the old group_listener logic and time both.
+
+    python bench/parsing_bench.py [iterations]
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from config import STATUS_MAP, NO_ANSWER_KEYS  # noqa: E402
+from parsing import Kind, parse_message  # noqa: E402
+
+
+# ----------------------------
+# REFERENCE (pre-parser group_listener)
+# ----------------------------
+LEGACY_ORDER_PATTERN = re.compile(
+    r"^(?P<orders>[0-9 ,/]+)\s+(?P<status>[a-zA-Z _-]+)$",
+    re.IGNORECASE
+)
+
+
+def legacy_normalize(text: str) -> str:
+    return text.lower().replace(" ", "").replace("-", "").replace("_", "")
+
+
+def legacy_parse(text: str, reply_text: str = None):
+    """(kind, orders, status, notify_admins) exactly as the old listener decided."""
+    if reply_text:
+        original_text = reply_text.strip()
+        replied_orders = [o for o in re.split(r"[,/ ]+", original_text) if o.isdigit() and 1 <= len(o) <= 6]
+        if replied_orders:
+            status_key = legacy_normalize(text)
+            if status_key in STATUS_MAP:
+                return Kind.REPLY, replied_orders, STATUS_MAP[status_key], False
+
+    if text.lower() == "done":
+        return Kind.DONE_ALL, [], STATUS_MAP["done"], False
+
+    raw_list = re.split(r"[,/ ]+", text)
+    only_numbers = [o for o in raw_list if o.isdigit() and 1 <= len(o) <= 6]
+    if only_numbers and len(only_numbers) == len(raw_list):
+        return Kind.OUT, only_numbers, STATUS_MAP["out"], False
+
+    match_done = re.match(r"^([0-9 ,/]+)\s+done$", text, re.IGNORECASE)
+    if match_done:
+        orders = [o for o in re.split(r"[,/ ]+", match_done.group(1)) if o.isdigit() and 1 <= len(o) <= 6]
+        if orders:
+            return Kind.DONE, orders, STATUS_MAP["done"], False
+        return Kind.NONE, [], None, False
+
+    match = LEGACY_ORDER_PATTERN.match(text)
+    if not match:
+        return Kind.NONE, [], None, False
+    orders = [o for o in re.split(r"[,/ ]+", match.group("orders")) if o.isdigit() and 1 <= len(o) <= 6]
+    if not orders:
+        return Kind.NONE, [], None, False
+    status_key = legacy_normalize(match.group("status"))
+    if status_key not in STATUS_MAP:
+        return Kind.NONE, [], None, False
+    return Kind.STATUS, orders, STATUS_MAP[status_key], status_key in NO_ANSWER_KEYS
+
+
+def new_parse(text: str, reply_text: str = None):
+    parsed = parse_message(text, reply_text, fuzzy=False)
+    if parsed.kind is Kind.NONE:
+        return Kind.NONE, [], None, False
+    return parsed.kind, list(parsed.orders), parsed.status, parsed.kind is Kind.STATUS and parsed.no_answer
+
+
+# ----------------------------
+# CORPUS
+# ----------------------------
+FIXED = [
+    ("123", None), ("123 45/6,7", None), ("1234567", None), ("123 1234567", None),
+    ("123 otw", None), ("123/45 otw", None), ("12 on the way", None), ("12 On-The_Way", None),
+    ("1080 no", None), ("1080 NO ANS", None), ("123 done", None), ("123  DONE", None),
+    ("123 d one", None), ("done", None), ("DONE", None), ("done!", None), ("1234567 done", None),
+    ("1234567 otw", None), ("123 xyz", None), ("123\notw", None), ("123\n124", None),
+    (",123", None), (",123 otw", None), ("123,", None), ("otw 123", None), ("", None),
+    ("hello", None), ("١٢٣", None), ("12 rwav", None), ("12 air", None),
+    ("got", "123, 124"), ("no", "555"), ("otw", "no numbers here"), ("done", "77/78"),
+    ("thanks", "12 13"), ("123", "44"), ("on the way", " 9 / 10 "),
+    ("123 - otw", None), ("ok", "call 3000-4000"), ("thanks", "call 3000-4000"), ("otw", "call 3000-4000"),
+]
+
+WORDS = list(STATUS_MAP) + ["done", "DONE", "Otw", "no ans", "xyz", "ok", "thanks", "on the way", "r c v d"]
+SEPS = [" ", ",", "/", ", ", " / ", "  "]
+
+
+def random_message(rng: random.Random):
+    ids = [str(rng.randint(0, 10 ** rng.randint(1, 8))) for _ in range(rng.randint(1, 6))]
+    body = ""
+    for oid in ids:
+        body += oid + rng.choice(SEPS)
+    body = body.rstrip(" ,/") if rng.random() < 0.8 else body
+    shape = rng.random()
+    if shape < 0.3:
+        text = body
+    elif shape < 0.9:
+        text = f"{body.strip()} {rng.choice(WORDS)}"
+    else:
+        text = rng.choice(WORDS)
+    reply = None
+    if rng.random() < 0.15:
+        reply = " ".join(str(rng.randint(1, 9999)) for _ in range(rng.randint(0, 3))) or "pinned"
+    return text.strip(), reply
+
+
+def corpus(size: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return FIXED + [random_message(rng) for _ in range(size)]
+
+
+def worst_cases(seed: int = 8) -> list:
+    """Messages near Telegram's 4096-character limit that used to take seconds to parse."""
+    rng = random.Random(seed)
+    letters = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(4000))
+    return [
+        "1" + " " * 4000 + "!",          # the order/status split backtracking over spaces
+        "1 " + "- " * 2000 + "5",        # ... and over dashes
+        "1 " + "- " * 2000 + "otw!",
+        "1 " + letters,                  # a typo lookup on a very long "status"
+    ]
+
+
+# ----------------------------
+# MAIN
+# ----------------------------
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = corpus(5000)
+
+    mismatches = [(m, legacy_parse(*m), new_parse(*m)) for m in messages if legacy_parse(*m) != new_parse(*m)]
+    for message, old, new in mismatches[:20]:
+        print(f"MISMATCH {message!r}: legacy={old} new={new}")
+    print(f"equivalence: {len(messages) - len(mismatches)}/{len(messages)} messages agree")
+
+    for name, fn in (("legacy", legacy_parse), ("parse_message", parse_message)):
+        seconds = timeit.timeit(lambda: [fn(*m) for m in messages], number=iterations)
+        per_message = seconds / (iterations * len(messages)) * 1e6
+        print(f"{name:>14}: {per_message:.2f} µs/message")
+
+    slowest = max(timeit.timeit(lambda: parse_message(m), number=1) for m in worst_cases())
+    print(f"{'worst case':>14}: {slowest * 1e3:.2f} ms/message")
+
+    sys.exit(1 if mismatches or slowest > 0.05 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""POST good and bad requests to a real WebhookServer and check every answer.
+
+    python bench/webhook_check.py
+
+The server runs on a free local port in front of a stub application
+(an update_queue and no bot), so nothing talks to Telegram. Every request
+must get the expected status line, and only the valid updates may reach
+the queue, as telegram.Update objects.
+"""
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Update  # noqa: E402
+
+from webhook import WebhookServer  # noqa: E402
+
+PATH = "/telegram"
+SECRET = "s3cret"
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": -100, "type": "group"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Ali"},
+        "text": "123 otw",
+    },
+}
+
+
+# ----------------------------
+# REQUESTS
+# ----------------------------
+def request(body: bytes = b"", method: str = "POST", path: str = PATH, secret: str = SECRET,
+            length: str = None) -> bytes:
+    head = [f"{method} {path} HTTP/1.1", "Host: localhost"]
+    if secret is not None:
+        head.append(f"X-Telegram-Bot-Api-Secret-Token: {secret}")
+    if length is None and method == "POST":
+        length = str(len(body))
+    if length is not None:
+        head.append(f"Content-Length: {length}")
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+
+def body(data) -> bytes:
+    return json.dumps(data).encode()
+
+
+# (name, raw request, expected status, queued updates)
+CASES = [
+    ("valid update", request(body(UPDATE)), "200", 1),
+    ("wrong secret", request(body(UPDATE), secret="nope"), "403", 0),
+    ("no secret", request(body(UPDATE), secret=None), "403", 0),
+    ("wrong path", request(body(UPDATE), path="/other"), "404", 0),
+    ("GET", request(method="GET"), "405", 0),
+    ("no length", request(body(UPDATE), length=""), "411", 0),
+    ("negative length", request(b"", length="-1"), "400", 0),
+    ("too large", request(b"", length=str(WebhookServer.MAX_BODY + 1)), "413", 0),
+    ("not JSON", request(b"{oops"), "400", 0),
+    ("not UTF-8", request(b"\xff\xfe"), "400", 0),
+    ("JSON list", request(body([1])), "400", 0),
+    ("JSON null", request(body(None)), "400", 0),
+    ("JSON number", request(body(7)), "400", 0),
+    ("empty object", request(body({})), "400", 0),
+    ("message not an object", request(body({"update_id": 2, "message": [1]})), "400", 0),
+    ("valid update again", request(body(dict(UPDATE, update_id=3))), "200", 1),
+]
+
+
+async def send(port: int, raw: bytes) -> str:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return response.split(b"\r\n", 1)[0].decode()
+
+
+# ----------------------------
+# MAIN
+# ----------------------------
+async def run() -> list:
+    app = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+    server = WebhookServer(app, "127.0.0.1", 0, PATH, secret_token=SECRET, drain_timeout=1)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+
+    problems = []
+    try:
+        for name, raw, expected, queued in CASES:
+            status_line = await send(port, raw)
+            got = app.update_queue.qsize()
+            updates = [app.update_queue.get_nowait() for _ in range(got)]
+            print(f"{name:>22}: {status_line or '(no response)'}")
+            if status_line.split(" ")[1:2] != [expected]:
+                problems.append(f"{name}: expected {expected}, got {status_line or 'no response'}")
+            if got != queued or not all(isinstance(u, Update) for u in updates):
+                problems.append(f"{name}: queued {updates!r}, expected {queued} update(s)")
+    finally:
+        await server.stop()
+    return problems
+
+
+def main():
+    problems = asyncio.run(run())
+    for problem in problems:
+        print("PROBLEM", problem)
+    print(f"{len(problems)} problems")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
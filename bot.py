@@ -1,137 +1,92 @@
-import json
-import os
-import re
 import asyncio
-from datetime import datetime, timedelta, timezone, time
-from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-
-# ----------------------------
-# CONFIG
-# ----------------------------
-BOT_TOKEN = ""  # Add your bot token
-GROUP_ID = -1002631348221
-ADMINS = [624102836, 7477828866]
-AGENT_LOG_CHANNEL = -1003484693080
-DATA_FILE = "orders.json"
-AGENTS_FILE = "agents.json"
-
-AUTO_DELETE_SECONDS = 10
-
-# ----------------------------
-# STATUS MAP
-# ----------------------------
-STATUS_MAP = {
-    "out": "Out for delivery",
-
-    "otw": "On the way to Hulhumale'",
-    "on": "On the way to Hulhumale'",
-    "ontheway": "On the way to Hulhumale'",
-    "on-the-way": "On the way to Hulhumale'",
-    "on_the_way": "On the way to Hulhumale'",
-
-    "got": "Received by Hulhumale' agents",
-    "rwav": "Received by Hulhumale' agents",
-    "resv": "Received by Hulhumale' agents",
-    "reav": "Received by Hulhumale' agents",
-    "rcvd": "Received by Hulhumale' agents",
-    "rwsv": "Received by Hulhumale' agents",
-    "rwv": "Received by Hulhumale' agents",
-
-    "no": "No answer from the number",
-    "noanswer": "No answer from the number",
-    "noanswers": "No answer from the number",
-    "noanswering": "No answer from the number",
-    "noans": "No answer from the number",
-
-    "air": "On the way to airport",
-    "done": "Order delivery completed",
-}
-
-NO_ANSWER_KEYS = {"no", "noanswer", "noanswers", "noanswering", "noans"}
-
-ORDER_PATTERN = re.compile(
-    r"^(?P<orders>[0-9 ,/]+)\s+(?P<status>[a-zA-Z _-]+)$",
-    re.IGNORECASE
+import html
+import logging
+import signal
+import time
+from datetime import date, timedelta
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import (
+    ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, ContextTypes, filters,
 )
 
+from config import (
+    BOT_TOKEN, BRANCHES, PAGE_SIZE, MYORDERS_PAGE_SIZE, HISTORY_PREVIEW, HISTORY_LOOKBACK_DAYS,
+    HISTORY_MAX_DAYS, AUTO_DELETE_SECONDS, PENDING_DELETES_FILE, FLUSH_INTERVAL_SECONDS, STATUS_MAP,
+    MAX_BULK_ORDERS, STALE_SWEEP_SECONDS, DIGEST_INTERVAL_SECONDS,
+    METRICS_HOST, METRICS_PORT, CONCURRENT_UPDATES, UPDATE_MODE,
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_DRAIN_SECONDS,
+    SHUTDOWN_DRAIN_SECONDS,
+)
+import metrics
+from analytics import fmt_duration
+from branches import Branches
+from dedup import message_key
+from outbox import DeletionScheduler
+from parsing import Kind, TooManyOrders, join_orders, parse_message, split_orders
+from store import now_gmt5, fmt_time, unpack_entry
+from webhook import WebhookServer
 
-# ----------------------------
-# HELPERS
-# ----------------------------
-def normalize_status_key(text: str) -> str:
-    return text.lower().replace(" ", "").replace("-", "").replace("_", "")
-
-
-def load_data() -> dict:
-    if not os.path.exists(DATA_FILE):
-        save_data({})
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
-
-
-def save_data(data: dict):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-
+branches = Branches(BRANCHES)
+deleter = DeletionScheduler(PENDING_DELETES_FILE)
+metrics_server = metrics.MetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
 
-def load_agents() -> dict:
-    if not os.path.exists(AGENTS_FILE):
-        save_agents({})
-    with open(AGENTS_FILE, "r") as f:
-        return json.load(f)
+logger = logging.getLogger(__name__)
 
+metrics.gauge("pending_deletes", lambda: deleter.depth)
 
-def save_agents(data: dict):
-    with open(AGENTS_FILE, "w") as f:
-        json.dump(data, f, indent=4)
 
+def branch_of(update: Update):
+    """The branch an update belongs to (see Branches.resolve), or None."""
+    return branches.resolve(update.effective_chat.id, update.effective_user.id)
 
-def remember_agent(user_id: int, name: str):
-    agents = load_agents()
-    agents[str(user_id)] = name
-    save_agents(agents)
 
+def admin_branch(update: Update):
+    """The branch an admin command acts on, its remaining arguments, and an error.
 
-def now_gmt5() -> datetime:
-    return datetime.now(timezone.utc) + timedelta(hours=5)
+    In a group that is the group's branch. In a private chat the branch is
+    named by the first argument ("/stats airport"); it may be left out by an
+    admin of a single branch. On failure the branch is None and the error is
+    the text to reply with.
+    """
+    args = update.message.text.split()[1:]
+    user_id = update.effective_user.id
+    if update.effective_chat.id != user_id:
+        branch = branches.for_chat(update.effective_chat.id)
+        if branch and branch.is_admin(user_id):
+            return branch, args, None
+        return None, args, ADMIN_ONLY_TEXT
 
+    administered = branches.administered(user_id)
+    if args and args[0] in branches.by_name:
+        branch = branches[args[0]]
+        if not branch.is_admin(user_id):
+            return None, args, ADMIN_ONLY_TEXT
+        return branch, args[1:], None
+    if len(administered) == 1:
+        return administered[0], args, None
+    if not administered:
+        return None, args, ADMIN_ONLY_TEXT
+    names = ", ".join(branch.name for branch in administered)
+    return None, args, f"❌ You administer several branches, name one first: {names}"
 
-def apply_status(data: dict, orders: list, status_full: str, agent_name: str) -> list:
-    """Apply a status to a list of order IDs. Returns list of updated IDs."""
-    updated = []
-    timestamp = now_gmt5().strftime("%H:%M")
 
-    for oid in orders:
-        current = data.get(oid, {})
-        if current.get("status") == STATUS_MAP["done"]:
-            continue
+# ----------------------------
+# TELEGRAM CALLS
+# ----------------------------
+async def reply(update: Update, text: str, **kwargs):
+    """update.message.reply_text(), timed and error-counted like every Telegram call."""
+    with metrics.timed("telegram", method="reply_text"):
+        return await update.message.reply_text(text, **kwargs)
 
-        current["status"] = status_full
-        current["timestamp"] = timestamp
-        current["agent"] = agent_name
-        current.setdefault("history", []).append({
-            "status": status_full,
-            "agent": agent_name,
-            "timestamp": timestamp,
-        })
-        data[oid] = current
-        updated.append(oid)
 
-    return updated
+async def send(bot, chat_id: int, text: str, **kwargs):
+    with metrics.timed("telegram", method="send_message"):
+        return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
 
 
 # ----------------------------
 # AUTO-DELETE / TEMP MESSAGES
 # ----------------------------
-async def _schedule_delete(bot, chat_id: int, message_id: int, delay_seconds: int):
-    await asyncio.sleep(delay_seconds)
-    try:
-        await bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception:
-        pass
-
-
 async def send_temporary_reply(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -139,70 +94,86 @@ async def send_temporary_reply(
     timeout: int = AUTO_DELETE_SECONDS,
     parse_mode=None,
 ):
-    if not update.message:
+    message = update.message or update.edited_message
+    if not message:
         return None
-    msg = await update.message.reply_text(text, parse_mode=parse_mode)
-    asyncio.create_task(_schedule_delete(context.bot, msg.chat_id, msg.message_id, timeout))
+    with metrics.timed("telegram", method="reply_text"):
+        msg = await message.reply_text(text, parse_mode=parse_mode)
+    deleter.schedule(msg.chat_id, msg.message_id, timeout)
     return msg
 
 
+ADMIN_ONLY_TEXT = "❌ Admin only."
+NO_BRANCH_TEXT = "❌ You're not part of any branch yet."
+TOO_MANY_TEXT = f"❌ At most {MAX_BULK_ORDERS} orders per message, please split it up."
+
+
 # ----------------------------
 # LOGGING HELPERS
 # ----------------------------
-async def send_agent_log(context, orders: list, agent_name: str, status_full: str, action: str = "Update", user_id: int = None):
-    orders_text = ", ".join(orders)
+def html_text(text: str) -> str:
+    """Escape user-supplied text (names, statuses) for parse_mode="HTML"."""
+    return html.escape(text, quote=False)
+
+
+def send_agent_log(context, branch, orders: list, agent_name: str, status_full: str, action: str = "Update", user_id: int = None):
+    orders_text = join_orders(orders)
+    agent_name = html_text(agent_name)
     agent_html = f'<a href="tg://user?id={user_id}">{agent_name}</a>' if user_id else agent_name
     msg = (
         f"<b>#{action}</b>\n"
         f"• Orders#: {orders_text}\n"
         f"• Agent: {agent_html}\n"
         f"• Time: {now_gmt5().strftime('%H:%M')} ⏰\n"
-        f"• Status: {status_full}"
+        f"• Status: {html_text(status_full)}"
     )
-    await context.bot.send_message(chat_id=AGENT_LOG_CHANNEL, text=msg, parse_mode="HTML")
+    branch.log_sender.post(branch.log_channel, msg, parse_mode="HTML")
 
 
-async def notify_admins(context, orders: list, agent_name: str):
-    msg = f"⚠️ Orders {', '.join(orders)} marked as NO ANSWER by {agent_name}"
-    for admin in ADMINS:
-        try:
-            await context.bot.send_message(chat_id=admin, text=msg)
-        except Exception:
-            pass
+def notify_admins(context, branch, orders: list, agent_name: str):
+    branch.notifier.alert(context.bot, orders, agent_name)
 
 
 # ----------------------------
 # /start
 # ----------------------------
+@metrics.handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("👋 Send an order number to check its status.")
+    await reply(update, "👋 Send an order number to check its status.")
 
 
 # ----------------------------
 # /urgent
 # ----------------------------
+@metrics.handler
 async def urgent_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.from_user.id not in ADMINS:
-        return await send_temporary_reply(update, context, "❌ Admin only.")
+    branch, args, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
 
-    args = update.message.text.split()[1:]
-    orders = [o for o in args if o.isdigit() and len(o) <= 6]
+    try:
+        orders = list(dict.fromkeys(split_orders(" ".join(args))))
+    except TooManyOrders:
+        return await send_temporary_reply(update, context, TOO_MANY_TEXT)
 
     if not orders:
         return await send_temporary_reply(update, context, "❌ No valid order numbers.")
 
-    msg = await context.bot.send_message(chat_id=GROUP_ID, text=f"🚨 URGENT ORDERS: {', '.join(orders)}")
+    # Ranges are kept compressed; replying to the pinned list expands them again.
+    msg = await send(context.bot, branch.group_id, f"🚨 URGENT ORDERS: {join_orders(orders)}")
     try:
-        await context.bot.pin_chat_message(chat_id=GROUP_ID, message_id=msg.message_id)
-    except Exception:
-        pass
+        with metrics.timed("telegram", method="pin_chat_message"):
+            await context.bot.pin_chat_message(chat_id=branch.group_id, message_id=msg.message_id)
+    except Exception as e:
+        logger.warning("Could not pin urgent orders: %s", e)
 
-    await send_temporary_reply(update, context, "✅ Urgent pinned.")
+    await send_temporary_reply(update, context, f"✅ Urgent pinned in {branch.name}.")
 
 
 # ----------------------------
 # LOOKUP ORDER (PRIVATE)
 # ----------------------------
+@metrics.handler
 async def lookup_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return
@@ -212,184 +183,267 @@ async def lookup_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not text.isdigit() or len(text) == 7:
         return
 
-    data = load_data()
+    found = [(branch, branch.store.get(text)) for branch in branches if text in branch.store]
+
+    if not found:
+        return await reply(update, "❌ No updates for this order yet.")
 
-    if text in data:
-        info = data[text]
-        await update.message.reply_text(
+    for branch, info in found:
+        where = f"Branch: {branch.name}\n" if len(branches.by_name) > 1 else ""
+        await reply(
+            update,
             f"Order#: {text}\n"
+            f"{where}"
             f"Status: {info['status']}\n"
-            f"Updated: {info['timestamp']}\n"
+            f"Updated: {fmt_time(info['ts'])}\n"
             f"By: {info['agent']}"
         )
-    else:
-        await update.message.reply_text("❌ No updates for this order yet.")
 
 
 # ----------------------------
 # GROUP LISTENER
 # ----------------------------
+@metrics.handler
 async def group_listener(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message or not update.message.text:
+    # Edited messages arrive here too; apply_message() applies only what the edit changed.
+    message = update.message or update.edited_message
+    if not message or not message.text:
         return
+    edited = update.message is None
 
-    if update.message.chat.id != GROUP_ID:
+    branch = branches.for_chat(message.chat.id)
+    if not branch:
         return
+    store = branch.store
 
-    text = update.message.text.strip()
-    agent_name = update.message.from_user.full_name
-    user_id = update.message.from_user.id
-
-    remember_agent(user_id, agent_name)
-
-    # (0) REPLY-BASED STATUS UPDATES
-    if update.message.reply_to_message and update.message.reply_to_message.text:
-        original_text = update.message.reply_to_message.text.strip()
-        replied_orders = [o for o in re.split(r"[,/ ]+", original_text) if o.isdigit() and 1 <= len(o) <= 6]
-
-        if replied_orders:
-            status_key = normalize_status_key(text)
-            if status_key in STATUS_MAP:
-                status_full = STATUS_MAP[status_key]
-                data = load_data()
-                updated = apply_status(data, replied_orders, status_full, agent_name)
-                save_data(data)
+    text = message.text.strip()
+    agent_name = message.from_user.full_name
+    user_id = message.from_user.id
 
-                if updated:
-                    await send_temporary_reply(update, context, f"🔁 Updated orders {', '.join(updated)} via reply.")
-                    await send_agent_log(context, updated, agent_name, status_full, action="Reply-Update", user_id=user_id)
-                return
+    store.remember_agent(user_id, agent_name)
 
-    # (1) "done" alone
-    if text.lower() == "done":
-        return await done_command(update, context)
-
-    # (2) AUTO-OUT: only numbers
-    raw_list = re.split(r"[,/ ]+", text)
-    only_numbers = [o for o in raw_list if o.isdigit() and 1 <= len(o) <= 6]
-
-    if only_numbers and len(only_numbers) == len(raw_list):
-        status_full = STATUS_MAP["out"]
-        data = load_data()
-        updated = apply_status(data, only_numbers, status_full, agent_name)
-        save_data(data)
+    reply = message.reply_to_message
+    parsed = parse_message(text, reply.text if reply else None)
+    kind = parsed.kind
 
-        if updated:
-            await send_temporary_reply(update, context, f"🚚 Marked {', '.join(updated)} as Out.")
-            await send_agent_log(context, updated, agent_name, status_full, action="Update", user_id=user_id)
+    if kind is Kind.NONE:
         return
 
-    # (3) MANUAL DONE: "123/33 done"
-    match_done = re.match(r"^([0-9 ,/]+)\s+done$", text, re.IGNORECASE)
-    if match_done:
-        orders = [o for o in re.split(r"[,/ ]+", match_done.group(1)) if o.isdigit() and 1 <= len(o) <= 6]
-        if orders:
-            status_full = STATUS_MAP["done"]
-            data = load_data()
-            updated = apply_status(data, orders, status_full, agent_name)
-            save_data(data)
-
-            if updated:
-                await send_temporary_reply(update, context, f"✅ Marked {', '.join(updated)} done.")
-                await send_agent_log(context, updated, agent_name, status_full, action="Done", user_id=user_id)
+    if kind is Kind.TOO_MANY:
+        if not edited:
+            await send_temporary_reply(update, context, TOO_MANY_TEXT)
         return
 
-    # (4) STANDARD UPDATES: "123 otw", "1080 no", etc.
-    match = ORDER_PATTERN.match(text)
-    if not match:
-        return
-
-    orders = [o for o in re.split(r"[,/ ]+", match.group("orders")) if o.isdigit() and 1 <= len(o) <= 6]
-    if not orders:
-        return
+    if kind is Kind.DONE_ALL:
+        if edited:
+            return  # editing a message into "done" doesn't complete every order
+        return await done_command(update, context)
 
-    status_key = normalize_status_key(match.group("status"))
-    if status_key not in STATUS_MAP:
-        return
+    status_full = parsed.status
+    updated = store.apply_message(
+        message_key(message), list(parsed.orders), status_full, agent_name, user_id, edited=edited,
+    )
 
-    status_full = STATUS_MAP[status_key]
-    data = load_data()
-    updated = apply_status(data, orders, status_full, agent_name)
-    save_data(data)
+    if kind is Kind.STATUS and parsed.no_answer:
+        notify_admins(context, branch, updated, agent_name)
 
-    if status_key in NO_ANSWER_KEYS:
-        await notify_admins(context, updated, agent_name)
+    if not updated:
+        return
 
-    if updated:
-        await send_temporary_reply(update, context, f"✅ Updated {len(updated)} order(s).")
-        await send_agent_log(context, updated, agent_name, status_full, action="Update", user_id=user_id)
+    if edited:
+        await send_temporary_reply(update, context, f"✏️ Edit applied to {join_orders(updated)}.")
+        send_agent_log(context, branch, updated, agent_name, status_full, action="Edit", user_id=user_id)
+    elif kind is Kind.REPLY:
+        await send_temporary_reply(update, context, f"🔁 Updated orders {join_orders(updated)} via reply.")
+        send_agent_log(context, branch, updated, agent_name, status_full, action="Reply-Update", user_id=user_id)
+    elif kind is Kind.OUT:
+        await send_temporary_reply(update, context, f"🚚 Marked {join_orders(updated)} as Out.")
+        send_agent_log(context, branch, updated, agent_name, status_full, action="Update", user_id=user_id)
+    elif kind is Kind.DONE:
+        await send_temporary_reply(update, context, f"✅ Marked {join_orders(updated)} done.")
+        send_agent_log(context, branch, updated, agent_name, status_full, action="Done", user_id=user_id)
+    else:
+        note = f" (read \"{parsed.typo}\" as {status_full})" if parsed.typo else ""
+        await send_temporary_reply(update, context, f"✅ Updated {len(updated)} order(s).{note}")
+        send_agent_log(context, branch, updated, agent_name, status_full, action="Update", user_id=user_id)
 
 
 # ----------------------------
 # /agents
 # ----------------------------
+@metrics.handler
 async def agents_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    agents = load_agents()
-
-    if not agents:
-        return await update.message.reply_text("No agents recorded yet.")
+    branch = branch_of(update)
+    if not branch or not branch.store.agents:
+        return await reply(update, "No agents recorded yet.")
 
     lines = ["🧑‍🤝‍🧑 *Registered Agents:*"]
-    for uid, name in agents.items():
+    for uid, name in branch.store.agents.items():
         lines.append(f"- [{name}](tg://user?id={uid}) — `ID:{uid}`")
 
-    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+    await reply(update, "\n".join(lines), parse_mode="Markdown")
 
 
 # ----------------------------
-# /myorders
+# PAGINATED LISTS (/status, /comp, /myorders, /check)
 # ----------------------------
-async def myorders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.message.from_user.full_name
-    data = load_data()
+def _last(info: dict) -> tuple:
+    """(status, agent, ts) of the order's latest history entry."""
+    history = info.get("history")
+    if not history:
+        return info["status"], info["agent"], info["ts"]
+    _, ts, status, agent = unpack_entry(history[-1])
+    return status, agent, ts
 
-    orders = [(oid, info) for oid, info in data.items() if info.get("agent") == user]
 
-    if not orders:
-        return await update.message.reply_text("You haven't updated any orders.")
+def _ongoing_line(oid: str, info: dict) -> str:
+    status, agent, ts = _last(info)
+    return f"- `{oid}` → {status} by {agent} at `{fmt_time(ts)}`"
+
+
+def _completed_line(oid: str, info: dict) -> str:
+    _, agent, ts = _last(info)
+    return f"- `{oid}` by {agent} at `{fmt_time(ts)}`"
+
+
+def _my_order_block(oid: str, info: dict) -> str:
+    history = info.get("history", [])
+    recent = [unpack_entry(h) for h in history[-HISTORY_PREVIEW:]]
+    hist = "\n".join(f"  - *{status}* at `{fmt_time(ts)}`" for _, ts, status, _ in reversed(recent)) or "_No history._"
+    if len(history) > len(recent):
+        hist += f"\n  - _…{len(history) - len(recent)} older, see /check {oid}_"
+    return f"\n*Order `{oid}`* → {info['status']} at `{fmt_time(info['ts'])}`\n{hist}"
 
-    msg = [f"📝 *Orders updated by {user}:*"]
-    for oid, info in orders:
-        history = info.get("history", [])
-        hist = "\n".join(f"  - *{h['status']}* at `{h['timestamp']}`" for h in reversed(history)) or "_No history._"
-        msg.append(f"\n*Order `{oid}`* → {info['status']} at `{info['timestamp']}`\n{hist}")
 
-    await update.message.reply_text("\n".join(msg), parse_mode="Markdown")
+def _history_line(h) -> str:
+    if isinstance(h, dict):  # archived before history entries were compacted
+        return f"- *{h['status']}* by {h['agent']} at `{h['timestamp']}`"
+    _, ts, status, agent = unpack_entry(h)
+    return f"- *{status}* by {agent} at `{fmt_time(ts)}`"
+
+
+async def _view_items(store, view: str, arg) -> list:
+    """The keys a paginated view walks over; only one page of them gets formatted."""
+    if view == "status":
+        return await store.find(exclude_status=STATUS_MAP["done"])
+    if view == "comp":
+        return await store.find(status=STATUS_MAP["done"])
+    if view == "mine":
+        return await store.find(agent_id=arg)
+    info = store.get(arg)
+    return info.get("history", []) if info else []
+
+
+def _iter_orders(store, ids):
+    for oid in ids:
+        info = store.get(oid)
+        if info is not None:
+            yield oid, info
+
+
+def _render_page(store, view: str, arg, items: list, page: int):
+    size = MYORDERS_PAGE_SIZE if view == "mine" else PAGE_SIZE
+    pages = max(1, -(-len(items) // size))
+    page = min(max(page, 0), pages - 1)
+    chunk = items[page * size:(page + 1) * size]
+
+    if view == "status":
+        lines = ["🚚 *Ongoing Orders:*"] + [_ongoing_line(oid, info) for oid, info in _iter_orders(store, chunk)]
+    elif view == "comp":
+        lines = ["✅ *Completed Orders:*"] + [_completed_line(oid, info) for oid, info in _iter_orders(store, chunk)]
+    elif view == "mine":
+        lines = [f"📝 *Orders updated by {store.agents.name(arg, arg)}:*"] + [_my_order_block(oid, info) for oid, info in _iter_orders(store, chunk)]
+    else:
+        info = store.get(arg) or {}
+        lines = [f"📝 *Order `{arg}`*", f"Status: *{info.get('status', '?')}*"] + [_history_line(h) for h in chunk]
+
+    markup = None
+    if pages > 1:
+        lines.append(f"\n_Page {page + 1}/{pages}_")
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️ Prev", callback_data="page:prev"))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton("Next ▶️", callback_data="page:next"))
+        markup = InlineKeyboardMarkup([buttons])
+
+    return "\n".join(lines), markup, page
+
+
+EMPTY_VIEW_TEXT = {
+    "status": "No ongoing orders.",
+    "comp": "No completed orders.",
+    "mine": "You haven't updated any orders.",
+}
+
+
+async def send_pages(update: Update, context: ContextTypes.DEFAULT_TYPE, branch, view: str, arg=None):
+    items = await _view_items(branch.store, view, arg)
+    if not items and view in EMPTY_VIEW_TEXT:
+        return await reply(update, EMPTY_VIEW_TEXT[view])
+
+    text, markup, page = _render_page(branch.store, view, arg, items, 0)
+    msg = await reply(update, text, parse_mode="Markdown", reply_markup=markup)
+    if markup:
+        context.user_data["pager"] = {
+            "branch": branch.name, "view": view, "arg": arg, "page": page, "message_id": msg.message_id,
+        }
+
+
+@metrics.handler
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    cursor = context.user_data.get("pager")
+
+    if not cursor or cursor["message_id"] != query.message.message_id:
+        with metrics.timed("telegram", method="answer_callback_query"):
+            return await query.answer("This list has expired, run the command again.")
+
+    step = 1 if query.data == "page:next" else -1
+    store = branches[cursor["branch"]].store
+    items = await _view_items(store, cursor["view"], cursor["arg"])
+    text, markup, page = _render_page(store, cursor["view"], cursor["arg"], items, cursor["page"] + step)
+
+    with metrics.timed("telegram", method="answer_callback_query"):
+        await query.answer()
+    if page != cursor["page"]:
+        cursor["page"] = page
+        with metrics.timed("telegram", method="edit_message_text"):
+            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=markup)
+
+
+# ----------------------------
+# /myorders
+# ----------------------------
+@metrics.handler
+async def myorders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    branch = branch_of(update)
+    if not branch:
+        return await reply(update, NO_BRANCH_TEXT)
+    user = update.message.from_user
+    branch.store.remember_agent(user.id, user.full_name)
+    await send_pages(update, context, branch, "mine", user.id)
 
 
 # ----------------------------
 # /mystats
 # ----------------------------
+@metrics.handler
 async def mystats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.message.from_user.full_name
-    data = load_data()
-
-    total = done = no_ans = in_prog = 0
-
-    for info in data.values():
-        if info.get("agent") != user:
-            continue
-        total += 1
-        status = info["status"].lower()
-        if status == STATUS_MAP["done"].lower():
-            done += 1
-        elif status == STATUS_MAP["no"].lower():
-            no_ans += 1
-        else:
-            in_prog += 1
-
-    await update.message.reply_text(
-        f"📊 Stats for {user}\n"
-        f"Total updated: {total}\n"
-        f"✅ Done: {done}\n"
-        f"🚚 In progress: {in_prog}\n"
-        f"❌ No answer: {no_ans}"
-    )
+    branch = branch_of(update)
+    if not branch:
+        return await reply(update, NO_BRANCH_TEXT)
+    user = update.message.from_user
+    branch.store.remember_agent(user.id, user.full_name)
+
+    lines = [f"📊 Stats for {user.full_name}"] + stats_lines(branch.store.stats.summary(agent_id=user.id))
+    await reply(update, "\n".join(lines))
 
 
 # ----------------------------
 # /check
 # ----------------------------
+@metrics.handler
 async def check_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = update.message.text.split()
 
@@ -397,211 +451,446 @@ async def check_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await send_temporary_reply(update, context, "Usage: /check 12345")
 
     order_id = args[1]
-    data = load_data()
-
-    if order_id not in data:
+    branch = branch_of(update)
+    if not branch or order_id not in branch.store:
         return await send_temporary_reply(update, context, "❌ Order not found.")
 
-    info = data[order_id]
-    msg = [f"📝 *Order `{order_id}`*", f"Status: *{info['status']}*"]
-    for h in info.get("history", []):
-        msg.append(f"- *{h['status']}* by {h['agent']} at `{h['timestamp']}`")
-
-    await update.message.reply_text("\n".join(msg), parse_mode="Markdown")
+    await send_pages(update, context, branch, "check", order_id)
 
 
 # ----------------------------
 # /reset
 # ----------------------------
+@metrics.handler
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.from_user.id not in ADMINS:
-        return await send_temporary_reply(update, context, "❌ Admin only.")
+    branch, _, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
 
-    save_data({})
-    save_agents({})
-    await send_temporary_reply(update, context, "🗑 All data cleared.")
+    branch.store.reset()
+    branch.store.flush()
+    await send_temporary_reply(update, context, f"🗑 All data cleared for {branch.name}.")
 
 
 # ----------------------------
 # /undone
 # ----------------------------
+@metrics.handler
 async def undone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.from_user.id not in ADMINS:
-        return await send_temporary_reply(update, context, "❌ Admin only.")
+    branch, args, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
+    store = branch.store
 
-    args = update.message.text.split()
-    if len(args) != 2 or not args[1].isdigit():
+    if len(args) != 1 or not args[0].isdigit():
         return await send_temporary_reply(update, context, "Usage: /undone 12345")
 
-    oid = args[1]
-    data = load_data()
-
-    if oid not in data:
-        return await send_temporary_reply(update, context, "Order not found.")
+    oid = args[0]
 
-    history = data[oid].get("history", [])
-    last = next((h for h in reversed(history) if h["status"] != STATUS_MAP["done"]), None)
+    if not store.revert(oid):
+        return await send_temporary_reply(update, context, f"Order not found in {branch.name}.")
 
-    if last:
-        data[oid].update({"status": last["status"], "timestamp": last["timestamp"], "agent": last["agent"]})
-    else:
-        data[oid].update({"status": "Pending", "timestamp": now_gmt5().strftime("%H:%M"), "agent": "Unknown"})
-
-    save_data(data)
-    await send_temporary_reply(update, context, f"🔄 Order {oid} reverted.")
+    await send_temporary_reply(update, context, f"🔄 Order {oid} reverted in {branch.name}.")
 
 
 # ----------------------------
 # /done
 # ----------------------------
+@metrics.handler
 async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    branch = branch_of(update)
+    if not branch:
+        return await send_temporary_reply(update, context, NO_BRANCH_TEXT)
+    store = branch.store
     agent = update.message.from_user.full_name
     user_id = update.message.from_user.id
-    remember_agent(user_id, agent)
+    key = message_key(update.message)
+    if store.processed.get(key):
+        return
+    store.remember_agent(user_id, agent)
 
-    data = load_data()
-    eligible = [oid for oid, info in data.items() if info.get("agent") == agent and info.get("status") != STATUS_MAP["done"]]
-    updated = apply_status(data, eligible, STATUS_MAP["done"], agent)
-    save_data(data)
+    eligible = await store.find(agent_id=user_id, exclude_status=STATUS_MAP["done"])
+    if store.processed.get(key):
+        return
+    # Other updates ran while find() awaited: keep only the orders still ours.
+    # Nothing awaits from here to apply_message(), so the check still holds.
+    still_mine = [oid for oid in eligible if (store.get(oid) or {}).get("agent_id") == user_id]
+    updated = store.apply_message(key, still_mine, STATUS_MAP["done"], agent, user_id)
 
     if not updated:
         return await send_temporary_reply(update, context, "No orders eligible for done.")
 
     await send_temporary_reply(update, context, f"✅ Marked {len(updated)} orders done.")
-    await send_agent_log(context, updated, agent, STATUS_MAP["done"], action="Done", user_id=user_id)
+    send_agent_log(context, branch, updated, agent, STATUS_MAP["done"], action="Done", user_id=user_id)
 
 
 # ----------------------------
 # /comp
 # ----------------------------
+@metrics.handler
 async def completed_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = load_data()
-    completed = [(oid, info) for oid, info in data.items() if info.get("status") == STATUS_MAP["done"]]
-
-    if not completed:
-        return await update.message.reply_text("No completed orders.")
-
-    msg = ["✅ *Completed Orders:*"]
-    for oid, info in completed:
-        last = (info.get("history") or [info])[-1]
-        msg.append(f"- `{oid}` by {last['agent']} at `{last['timestamp']}`")
-
-    await update.message.reply_text("\n".join(msg), parse_mode="Markdown")
+    branch = branch_of(update)
+    if not branch:
+        return await reply(update, NO_BRANCH_TEXT)
+    await send_pages(update, context, branch, "comp")
 
 
 # ----------------------------
 # /status
 # ----------------------------
+@metrics.handler
 async def ongoing_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = load_data()
-    ongoing = [(oid, info) for oid, info in data.items() if info.get("status") != STATUS_MAP["done"]]
+    branch = branch_of(update)
+    if not branch:
+        return await reply(update, NO_BRANCH_TEXT)
+    await send_pages(update, context, branch, "status")
+
+
+# ----------------------------
+# /stats
+# ----------------------------
+def stats_lines(counts: dict) -> list:
+    return [
+        f"Total updated: {counts['total']}",
+        f"✅ Done: {counts['done']}",
+        f"🚚 In progress: {counts['in_progress']}",
+        f"❌ No answer: {counts['no_answer']}",
+    ]
 
-    if not ongoing:
-        return await update.message.reply_text("No ongoing orders.")
 
-    msg = ["🚚 *Ongoing Orders:*"]
-    for oid, info in ongoing:
-        last = (info.get("history") or [info])[-1]
-        msg.append(f"- `{oid}` → {last['status']} by {last['agent']} at `{last['timestamp']}`")
+def agent_lines(agent_stats: dict, escape=str) -> list:
+    """Pass escape=html_text when the lines go into an HTML message."""
+    return [f"- {escape(agent)}: {s['total']} updated, {s['done']} done" for agent, s in agent_stats.items()]
 
-    await update.message.reply_text("\n".join(msg), parse_mode="Markdown")
+
+@metrics.handler
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    branch, _, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
+    store = branch.store
+
+    if not store:
+        return await send_temporary_reply(update, context, f"No orders yet in {branch.name}.")
+
+    msg = [f"📊 *Today's Stats — {branch.name}*"] + stats_lines(store.stats.summary())
+    msg.append("\n🧍 *Agent Breakdown:*")
+    msg += agent_lines(store.stats.agents())
+
+    if branch.notifier.failures:
+        msg.append("\n⚠️ *Admin alert failures:*")
+        for chat_id, f in branch.notifier.failures.items():
+            msg.append(f"- `{chat_id}`: {f['count']} failed, last: `{f['last_error']}`")
+
+    await reply(update, "\n".join(msg), parse_mode="Markdown")
 
 
 # ----------------------------
-# /stats
+# /latency
 # ----------------------------
-async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.from_user.id not in ADMINS:
-        return await send_temporary_reply(update, context, "❌ Admin only.")
-
-    data = load_data()
-    if not data:
-        return await send_temporary_reply(update, context, "No orders yet.")
-
-    total = done = no_ans = in_prog = 0
-    agent_stats = {}
-
-    for info in data.values():
-        status = info.get("status", "").lower()
-        agent = info.get("agent", "Unknown")
-
-        entry = agent_stats.setdefault(agent, {"total": 0, "done": 0})
-        entry["total"] += 1
-        total += 1
-
-        if status == STATUS_MAP["done"].lower():
-            entry["done"] += 1
-            done += 1
-        elif status == STATUS_MAP["no"].lower():
-            no_ans += 1
-        else:
-            in_prog += 1
-
-    msg = [
-        "📊 *Today's Stats*",
-        f"Total updated: {total}",
-        f"✅ Done: {done}",
-        f"🚚 In progress: {in_prog}",
-        f"❌ No answer: {no_ans}",
-        "\n🧍 *Agent Breakdown:*",
-    ]
-    for agent, s in agent_stats.items():
-        msg.append(f"- {agent}: {s['total']} updated, {s['done']} done")
+def _percentile_line(label: str, p: dict) -> str:
+    return (
+        f"- {label}: p50 {fmt_duration(p['p50'])}, p95 {fmt_duration(p['p95'])}, "
+        f"p99 {fmt_duration(p['p99'])} ({p['count']})"
+    )
+
 
-    await update.message.reply_text("\n".join(msg), parse_mode="Markdown")
+def latency_lines(latency, escape=str) -> list:
+    pairs = sorted(latency.pairs().items(), key=lambda item: -item[1]["count"])
+    agents = sorted(latency.agents().items())
+    if not pairs:
+        return []
+    lines = ["\n⏱ Time in status:"]
+    lines += [_percentile_line(f"{before} → {after}", p) for (before, after), p in pairs]
+    lines.append("\n⏱ Time to next update, by agent:")
+    lines += [_percentile_line(escape(agent), p) for agent, p in agents]
+    return lines
+
+
+@metrics.handler
+async def latency(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    branch, _, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
+
+    lines = latency_lines(branch.store.latency)
+    if not lines:
+        return await send_temporary_reply(update, context, f"No status changes to time yet today in {branch.name}.")
+
+    await reply(update, join_limited([f"⏱ *Today's delivery times — {branch.name}*"] + lines), parse_mode="Markdown")
 
 
 # ----------------------------
 # DAILY SUMMARY + RESET
 # ----------------------------
+@metrics.handler
 async def daily_summary(context: ContextTypes.DEFAULT_TYPE):
-    data = load_data()
+    """Archive and clear the day, then post its summary.
+
+    The day is read, archived and cleared without awaiting, so an update
+    that arrives while the summary is sent belongs to the next day.
+    """
+    branch = branches[context.job.data]
+    store = branch.store
+    if not store:
+        store.clear()
+        store.flush()
+        await send(context.bot, branch.log_channel, "📊 Daily Summary (No orders today).")
+        return
 
-    if not data:
-        await context.bot.send_message(chat_id=AGENT_LOG_CHANNEL, text="📊 Daily Summary (No orders today).")
-        save_data({})
+    summary, agents, snapshot = store.stats.summary(), store.stats.agents(), store.snapshot()
+    msg = ["📊 <b>Daily Summary</b>"] + stats_lines(summary)
+    msg.append("\n<b>🧍 Agent Breakdown:</b>")
+    msg += agent_lines(agents, escape=html_text)
+    msg += latency_lines(store.latency, escape=html_text)
+
+    store.writer.submit(branch.archive.roll, (now_gmt5() - timedelta(days=1)).date(), snapshot, summary, agents)
+    store.clear()
+    store.flush()
+    await send(context.bot, branch.log_channel, join_limited(msg), parse_mode="HTML")
+
+
+# ----------------------------
+# STALE ORDERS + DIGEST (JOBS)
+# ----------------------------
+def stale_lines(store, overdue: list) -> list:
+    """One line per agent and status; the agent is mentioned so Telegram notifies them."""
+    groups = {}
+    for oid, info in overdue:
+        groups.setdefault((info.get("agent_id"), info["agent"], info["status"]), []).append(oid)
+    lines = []
+    for (agent_id, agent, status), orders in groups.items():
+        agent = html_text(agent)
+        who = f'<a href="tg://user?id={agent_id}">{agent}</a>' if agent_id else agent
+        lines.append(f"- {who}: {join_orders(orders)} — {html_text(status)} for over {fmt_duration(store.stale.limits[status])}")
+    return lines
+
+
+@metrics.handler
+async def stale_sweep(context: ContextTypes.DEFAULT_TYPE):
+    """Ping the agents whose orders stayed in a status past STALE_AFTER_MINUTES."""
+    branch = branches[context.job.data]
+    store = branch.store
+    overdue = store.overdue()
+    if not overdue:
         return
 
-    total = done = no_ans = in_prog = 0
-    agent_stats = {}
-
-    for info in data.values():
-        status = info.get("status", "").lower()
-        agent = info.get("agent", "Unknown")
-
-        entry = agent_stats.setdefault(agent, {"total": 0, "done": 0})
-        entry["total"] += 1
-        total += 1
-
-        if status == STATUS_MAP["done"].lower():
-            entry["done"] += 1
-            done += 1
-        elif status == STATUS_MAP["no"].lower():
-            no_ans += 1
-        else:
-            in_prog += 1
-
-    msg = [
-        "📊 <b>Daily Summary</b>",
-        f"Total updated: {total}",
-        f"✅ Done: {done}",
-        f"🚚 In progress: {in_prog}",
-        f"❌ No answer: {no_ans}",
-        "\n<b>🧍 Agent Breakdown:</b>",
-    ]
-    for agent, s in agent_stats.items():
-        msg.append(f"- {agent}: {s['total']} updated, {s['done']} done")
+    held = [(oid, info) for oid, info in overdue if info.get("agent_id")]
+    unheld = [(oid, info) for oid, info in overdue if not info.get("agent_id")]
+    if held:
+        msg = join_limited(["⏰ <b>These orders haven't moved:</b>"] + stale_lines(store, held))
+        branch.log_sender.post(branch.group_id, msg, parse_mode="HTML")
+    if unheld:
+        msg = join_limited(["⏰ <b>Orders stuck without a known agent:</b>"] + stale_lines(store, unheld))
+        for admin in branch.admins:
+            branch.log_sender.post(admin, msg, parse_mode="HTML")
+
+
+@metrics.handler
+async def update_digest(context: ContextTypes.DEFAULT_TYPE):
+    """Post the status updates since the previous digest to the log channel.
+
+    The store only counts updates by (agent, status); the job keeps the
+    previous reading and reports the difference, so a digest costs
+    O(agents × statuses) however many orders the day has.
+    """
+    state = context.job.data
+    branch = branches[state["branch"]]
+    store = branch.store
+    counts, since, started = dict(store.updates), state["counts"], state["at"]
+    state["counts"], state["at"] = counts, now_gmt5()
+
+    delta = {key: n - since.get(key, 0) for key, n in counts.items() if n > since.get(key, 0)}
+    if not delta:
+        return
+
+    by_status, by_agent = {}, {}
+    for (agent, status), n in delta.items():
+        by_status[status] = by_status.get(status, 0) + n
+        by_agent[agent] = by_agent.get(agent, 0) + n
 
-    await context.bot.send_message(chat_id=AGENT_LOG_CHANNEL, text="\n".join(msg), parse_mode="HTML")
-    save_data({})
+    msg = [f"🕐 <b>Updates since {started.strftime('%H:%M')}</b>: {sum(delta.values())}"]
+    msg += [f"- {html_text(status)}: {n}" for status, n in sorted(by_status.items(), key=lambda item: -item[1])]
+    msg.append("\n<b>🧍 By agent:</b>")
+    msg += [f"- {html_text(agent)}: {n}" for agent, n in sorted(by_agent.items(), key=lambda item: -item[1])]
+    msg.append(f"\n🚚 In progress now: {store.stats.summary()['in_progress']}")
+    branch.log_sender.post(branch.log_channel, join_limited(msg), parse_mode="HTML")
 
 
 # ----------------------------
-# MAIN
+# /history, /report (ARCHIVE)
 # ----------------------------
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def join_limited(lines: list, limit: int = 4000) -> str:
+    """Join whole lines up to Telegram's message size, so Markdown is never cut mid-entity."""
+    out, size = [], 0
+    for line in lines:
+        if size + len(line) + 1 > limit:
+            out.append("…")
+            break
+        out.append(line)
+        size += len(line) + 1
+    return "\n".join(out)
 
+
+@metrics.handler
+async def order_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    branch, args, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
+
+    if len(args) not in (1, 2) or not all(arg.isdecimal() for arg in args):
+        return await send_temporary_reply(update, context, "Usage: /history 12345 [days]")
+
+    oid = args[0]
+    days = min(int(args[1]), HISTORY_MAX_DAYS) if len(args) == 2 else HISTORY_LOOKBACK_DAYS
+    since = (now_gmt5() - timedelta(days=days)).date()
+
+    found = branch.archive.lookup(oid, start=since)
+    if oid in branch.store:
+        found.append(("today", branch.store.get(oid)))
+
+    if not found:
+        return await send_temporary_reply(update, context, f"❌ No history for {oid} in {branch.name} in the last {days} days.")
+
+    msg = [f"📜 *History for `{oid}` — {branch.name}*"]
+    for day, info in found:
+        msg.append(f"\n*{day}* → {info['status']}")
+        msg += [_history_line(h) for h in info.get("history", [])]
+
+    await reply(update, join_limited(msg), parse_mode="Markdown")
+
+
+def _parse_day(text: str):
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+@metrics.handler
+async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    branch, args, error = admin_branch(update)
+    if error:
+        return await send_temporary_reply(update, context, error)
+
+    today = now_gmt5().date()
+    if not args:
+        start, end = today - timedelta(days=7), today
+    else:
+        start = _parse_day(args[0])
+        end = _parse_day(args[1]) if len(args) > 1 else start
+        if start is None or end is None or len(args) > 2:
+            return await send_temporary_reply(update, context, "Usage: /report 2024-05-01 2024-05-31")
+
+    result = branch.archive.report(start, end)
+    if not result["days"]:
+        return await send_temporary_reply(update, context, f"No archived days for {branch.name} between {start} and {end}.")
+
+    msg = [f"📈 *Report {branch.name} {start} → {end}* ({len(result['days'])} days)"] + stats_lines(result["totals"])
+    msg.append("\n📅 *Per day:*")
+    msg += [f"- {day}: {s['total']} updated, {s['done']} done" for day, s in result["days"]]
+    msg.append("\n🧍 *Agent Breakdown:*")
+    msg += agent_lines(result["agents"])
+
+    await reply(update, join_limited(msg), parse_mode="Markdown")
+
+
+# ----------------------------
+# STORAGE FLUSH / LIFECYCLE
+# ----------------------------
+@metrics.handler
+async def flush_store(context: ContextTypes.DEFAULT_TYPE):
+    for branch in branches:
+        branch.store.flush()
+    deleter.flush()
+
+
+async def on_startup(app):
+    """Load every branch and schedule the jobs before the first update is fetched."""
+    started = time.perf_counter()
+    with metrics.timed("lifecycle", phase="startup"):
+        for branch in branches:
+            branch.load()
+        add_jobs(app)
+    logger.info(
+        "Loaded %d orders in %d branch(es) in %.2fs",
+        sum(len(branch.store) for branch in branches), len(branches.by_name), time.perf_counter() - started,
+    )
+    for branch in branches:
+        branch.log_sender.start(app.bot)
+    deleter.start(app.bot)
+    if metrics_server:
+        await metrics_server.start()
+
+
+async def on_stop(app):
+    """Send what is still queued while the bot can still reach Telegram.
+
+    Runs once no more updates are handled. Gives up after
+    SHUTDOWN_DRAIN_SECONDS so a Telegram outage can't hold up the flush.
+    """
+    async def drain():
+        await asyncio.gather(*(branch.notifier.stop() for branch in branches))
+        await asyncio.gather(*(branch.log_sender.stop() for branch in branches))
+        await deleter.stop(drain_within=AUTO_DELETE_SECONDS)
+
+    started = time.perf_counter()
+    try:
+        with metrics.timed("lifecycle", phase="drain"):
+            await asyncio.wait_for(drain(), SHUTDOWN_DRAIN_SECONDS)
+    except asyncio.TimeoutError:
+        unsent = sum(branch.log_sender.depth for branch in branches)
+        logger.warning("Shutdown drain gave up after %ss, %d log messages unsent", SHUTDOWN_DRAIN_SECONDS, unsent)
+    logger.info("Drained outgoing messages in %.2fs", time.perf_counter() - started)
+
+
+async def on_shutdown(app):
+    """Flush every branch to disk; each file is replaced atomically (see write_json)."""
+    await deleter.stop()  # saves what a cut-short drain left pending
+    with metrics.timed("lifecycle", phase="flush"):
+        for branch in branches:
+            try:
+                branch.store.close()
+            except Exception:
+                logger.exception("Could not flush branch %s", branch.name)
+    if metrics_server:
+        await metrics_server.stop()
+
+
+async def serve_webhook(app):
+    """Run the bot behind WebhookServer until SIGINT/SIGTERM, then drain."""
+    server = WebhookServer(
+        app, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None, drain_timeout=WEBHOOK_DRAIN_SECONDS,
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    await on_startup(app)
+    await app.start()
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            with metrics.timed("telegram", method="set_webhook"):
+                await app.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, allowed_updates=Update.ALL_TYPES)
+        await stop.wait()
+    finally:
+        # Refuse new requests first; app.stop() then handles every update already queued.
+        await server.stop()
+        await app.stop()
+        await on_stop(app)
+        await app.shutdown()
+        await on_shutdown(app)
+
+
+# ----------------------------
+# MAIN
+# ----------------------------
+def add_handlers(app):
+    """Register the update handlers; the first one that matches an update handles it."""
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("myorders", myorders))
     app.add_handler(CommandHandler("mystats", mystats))
@@ -614,14 +903,47 @@ def main():
     app.add_handler(CommandHandler("check", check_order))
     app.add_handler(CommandHandler("urgent", urgent_command))
     app.add_handler(CommandHandler("agents", agents_list))
+    app.add_handler(CommandHandler("history", order_history))
+    app.add_handler(CommandHandler("report", report))
+    app.add_handler(CommandHandler("latency", latency))
+    app.add_handler(CallbackQueryHandler(page_callback, pattern=r"^page:"))
+
+    app.add_handler(MessageHandler(filters.Chat(branches.group_ids) & filters.TEXT & ~filters.COMMAND, group_listener))
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, lookup_order))
+
+
+def add_jobs(app):
+    """Schedule the periodic jobs: each branch's summary, stale sweep and digest, and the flush.
+
+    Call it once the stores are loaded; the digests take their first reading here.
+    """
+    jobs = app.job_queue
+    for branch in branches:
+        jobs.run_daily(daily_summary, time=branch.summary_time, data=branch.name, name=f"daily_summary:{branch.name}")
+        jobs.run_repeating(stale_sweep, interval=STALE_SWEEP_SECONDS, data=branch.name, name=f"stale_sweep:{branch.name}")
+        jobs.run_repeating(
+            update_digest, interval=DIGEST_INTERVAL_SECONDS, name=f"update_digest:{branch.name}",
+            data={"branch": branch.name, "counts": dict(branch.store.updates), "at": now_gmt5()},
+        )
+    jobs.run_repeating(flush_store, interval=FLUSH_INTERVAL_SECONDS)
 
-    app.add_handler(MessageHandler(filters.Chat(GROUP_ID) & filters.TEXT & ~filters.COMMAND, group_listener))
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, lookup_order))
 
-    app.job_queue.run_daily(daily_summary, time=time(hour=1, minute=0, tzinfo=timezone.utc))
+def main():
+    builder = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(CONCURRENT_UPDATES)
+    if UPDATE_MODE == "webhook":
+        app = builder.updater(None).build()
+    else:
+        app = builder.post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
+
+    add_handlers(app)
 
     print("Bot running...")
-    app.run_polling(drop_pending_updates=True)
+    if UPDATE_MODE == "webhook":
+        asyncio.run(serve_webhook(app))
+    else:
+        # Messages sent while the bot was down are handled now; one already
+        # applied before the restart is recognised as processed and skipped.
+        app.run_polling(drop_pending_updates=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+import os
+from datetime import time, timezone
+
+import metrics
+from archive import OrderArchive
+from config import (
+    DATA_FILE, AGENTS_FILE, ARCHIVE_DIR, STORAGE_BACKEND, JOURNAL_FILE, SNAPSHOT_FILE, JOURNAL_COMPACT_EVENTS,
+    DB_FILE, PROCESSED_FILE, PROCESSED_CACHE_SIZE, PROCESSED_TTL_SECONDS,
+    ADMIN_ALERT_WINDOW_SECONDS, ADMIN_ALERT_CONCURRENCY, STALE_AFTER_MINUTES, LOG_COALESCE_SECONDS,
+    LOG_MIN_INTERVAL_SECONDS,
+)
+from deadlines import StaleOrders
+from dedup import ProcessedMessages
+from outbox import AdminNotifier, LogSender
+from store import open_store
+
+
+# ----------------------------
+# BRANCH
+# ----------------------------
+class Branch:
+    """One dispatch group with everything that belongs only to it.
+
+    A branch has its own store (files, indexes and counters),
+    archive, admins, log channel, log sender and admin notifier. Nothing
+    is shared between branches, so one branch's writes, summaries and
+    posts never scan or wait on another's.
+    """
+
+    def __init__(self, name: str, group_id: int, admins: list, log_channel: int,
+                 data_dir: str = ".", summary_time: str = "01:00"):
+        self.name = name
+        self.group_id = group_id
+        self.admins = set(admins)
+        self.log_channel = log_channel
+        self.data_dir = data_dir
+        hour, minute = map(int, summary_time.split(":"))
+        self.summary_time = time(hour=hour, minute=minute, tzinfo=timezone.utc)
+
+        def path(name):
+            return os.path.join(data_dir, name)
+
+        self.store = open_store(
+            STORAGE_BACKEND, path(DATA_FILE), path(AGENTS_FILE),
+            journal_file=path(JOURNAL_FILE), snapshot_file=path(SNAPSHOT_FILE),
+            compact_every=JOURNAL_COMPACT_EVENTS, db_file=path(DB_FILE),
+            processed_file=path(PROCESSED_FILE),
+            processed=ProcessedMessages(PROCESSED_CACHE_SIZE, PROCESSED_TTL_SECONDS),
+            stale=StaleOrders({status: minutes * 60 for status, minutes in STALE_AFTER_MINUTES.items()}),
+        )
+        self.archive = OrderArchive(path(ARCHIVE_DIR))
+        self.notifier = AdminNotifier(list(admins), window=ADMIN_ALERT_WINDOW_SECONDS, concurrency=ADMIN_ALERT_CONCURRENCY)
+        self.log_sender = LogSender(window=LOG_COALESCE_SECONDS, min_interval=LOG_MIN_INTERVAL_SECONDS)
+
+        metrics.gauge("orders", lambda: len(self.store), branch=name)
+        metrics.gauge("log_queue_depth", lambda: self.log_sender.depth, branch=name)
+        metrics.gauge("admin_alert_failures", lambda: sum(f["count"] for f in self.notifier.failures.values()), branch=name)
+
+    def load(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.store.load()
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins
+
+
+# ----------------------------
+# BRANCH DIRECTORY
+# ----------------------------
+class Branches:
+    """All configured branches, looked up by group chat or by user."""
+
+    def __init__(self, configs: list):
+        self.by_name = {}
+        self.by_group = {}
+        for config in configs:
+            branch = Branch(**config)
+            if branch.name in self.by_name or branch.group_id in self.by_group:
+                raise ValueError(f"Branch {branch.name} ({branch.group_id}) is configured twice")
+            self.by_name[branch.name] = branch
+            self.by_group[branch.group_id] = branch
+
+    def __iter__(self):
+        return iter(self.by_name.values())
+
+    def __getitem__(self, name: str) -> Branch:
+        return self.by_name[name]
+
+    @property
+    def group_ids(self) -> list:
+        return list(self.by_group)
+
+    def for_chat(self, chat_id: int):
+        return self.by_group.get(chat_id)
+
+    def for_user(self, user_id: int):
+        """The first branch the user administers, else the first they have worked for."""
+        for branch in self:
+            if branch.is_admin(user_id):
+                return branch
+        for branch in self:
+            if user_id in branch.store.agents:
+                return branch
+        return None
+
+    def administered(self, user_id: int) -> list:
+        return [branch for branch in self if branch.is_admin(user_id)]
+
+    def resolve(self, chat_id: int, user_id: int):
+        """The branch a message is about: its group, or for private chats the sender's branch."""
+        return self.for_chat(chat_id) or (self.for_user(user_id) if chat_id == user_id else None)
@@ -0,0 +1,168 @@
+# ----------------------------
+# CONFIG
+# ----------------------------
+BOT_TOKEN = ""  # Add your bot token
+GROUP_ID = -1002631348221
+ADMINS = [624102836, 7477828866]
+AGENT_LOG_CHANNEL = -1003484693080
+DATA_FILE = "orders.json"
+AGENTS_FILE = "agents.json"
+
+AUTO_DELETE_SECONDS = 10
+
+# /status, /comp and /check list this many lines per page; /myorders this
+# many orders, each with its latest HISTORY_PREVIEW history entries.
+PAGE_SIZE = 25
+MYORDERS_PAGE_SIZE = 8
+HISTORY_PREVIEW = 5
+
+# One message ("101-160 otw", /urgent 101-160) may name at most this many orders.
+MAX_BULK_ORDERS = 500
+PENDING_DELETES_FILE = "pending_deletes.json"
+
+# Agent-log posts arriving within this window go out as one channel
+# message, and the channel gets at most one message per interval.
+LOG_COALESCE_SECONDS = 2
+LOG_MIN_INTERVAL_SECONDS = 3
+
+# Repeated NO ANSWER alerts within this window are merged into one digest.
+ADMIN_ALERT_WINDOW_SECONDS = 60
+ADMIN_ALERT_CONCURRENCY = 5
+
+# Dirty orders/agents are written back to disk at most this often.
+FLUSH_INTERVAL_SECONDS = 5
+
+# Orders left in one of these statuses for longer than the given minutes are
+# reported once: every STALE_SWEEP_SECONDS the agent holding them is
+# mentioned in the branch group (orders without a known agent go to the
+# admins). Every DIGEST_INTERVAL_SECONDS the log channel gets a digest of the
+# status updates since the previous one; quiet intervals are skipped.
+STALE_AFTER_MINUTES = {
+    "No answer from the number": 30,
+    "On the way to airport": 120,
+}
+STALE_SWEEP_SECONDS = 60
+DIGEST_INTERVAL_SECONDS = 3600
+
+# "json" rewrites DATA_FILE on flush, "journal" appends each update to
+# JOURNAL_FILE and compacts it into SNAPSHOT_FILE every N events, "sqlite"
+# keeps orders in DB_FILE. Journal and SQLite import DATA_FILE on first start.
+STORAGE_BACKEND = "json"
+JOURNAL_FILE = "orders.journal"
+SNAPSHOT_FILE = "orders.snapshot.json"
+JOURNAL_COMPACT_EVENTS = 500
+DB_FILE = "orders.db"
+
+# Group messages already applied are remembered (in PROCESSED_FILE for the
+# json backend, with the orders otherwise) so a redelivered message is not
+# applied twice and an edited one only applies what changed. The newest
+# PROCESSED_CACHE_SIZE messages are kept, each for PROCESSED_TTL_SECONDS.
+PROCESSED_FILE = "processed.json"
+PROCESSED_CACHE_SIZE = 10000
+PROCESSED_TTL_SECONDS = 48 * 3600
+
+# Each day's orders are archived here by the daily summary instead of being
+# thrown away; /history looks back this many days by default, and at most
+# HISTORY_MAX_DAYS when asked for more.
+ARCHIVE_DIR = "archive"
+HISTORY_LOOKBACK_DAYS = 60
+HISTORY_MAX_DAYS = HISTORY_LOOKBACK_DAYS * 12
+
+# "polling" long-polls Telegram for updates. "webhook" serves them on
+# WEBHOOK_LISTEN:WEBHOOK_PORT at WEBHOOK_PATH and registers WEBHOOK_URL (the
+# public https address that forwards to it) with Telegram. WEBHOOK_SECRET is
+# echoed back by Telegram on every request; requests without it are refused.
+UPDATE_MODE = "polling"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_URL = ""
+WEBHOOK_SECRET = ""
+WEBHOOK_DRAIN_SECONDS = 10
+
+# On shutdown, queued log messages and alerts are sent and temporary replies
+# due within AUTO_DELETE_SECONDS are deleted, for at most this long; the
+# orders are flushed to disk either way. Updates sent while the bot was down
+# are fetched and handled on the next start.
+SHUTDOWN_DRAIN_SECONDS = 15
+
+# How many updates may be handled at the same time (1 = one after another).
+# Each store change is applied without awaiting, so concurrent updates to
+# the same orders can't lose each other's history.
+CONCURRENT_UPDATES = 1
+
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics.
+# Set METRICS_PORT to 0 to turn the endpoint off.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# ----------------------------
+# BRANCHES
+# ----------------------------
+# One entry per dispatch group. A branch keeps its orders, agents and archive
+# under its own data_dir (file names as configured above), has its own admins
+# and log channel, and gets its daily summary at summary_time (UTC). The
+# first entry is the original single-group setup and keeps its files where
+# they always were.
+BRANCHES = [
+    {
+        "name": "main",
+        "group_id": GROUP_ID,
+        "admins": ADMINS,
+        "log_channel": AGENT_LOG_CHANNEL,
+        "data_dir": ".",
+        "summary_time": "01:00",
+    },
+    # {
+    #     "name": "airport",
+    #     "group_id": -100...,
+    #     "admins": [...],
+    #     "log_channel": -100...,
+    #     "data_dir": "branches/airport",
+    #     "summary_time": "01:00",
+    # },
+]
+
+# ----------------------------
+# STATUS MAP
+# ----------------------------
+STATUS_MAP = {
+    "out": "Out for delivery",
+
+    "otw": "On the way to Hulhumale'",
+    "on": "On the way to Hulhumale'",
+    "ontheway": "On the way to Hulhumale'",
+    "on-the-way": "On the way to Hulhumale'",
+    "on_the_way": "On the way to Hulhumale'",
+
+    "got": "Received by Hulhumale' agents",
+    "rwav": "Received by Hulhumale' agents",
+    "resv": "Received by Hulhumale' agents",
+    "reav": "Received by Hulhumale' agents",
+    "rcvd": "Received by Hulhumale' agents",
+    "rwsv": "Received by Hulhumale' agents",
+    "rwv": "Received by Hulhumale' agents",
+
+    "no": "No answer from the number",
+    "noanswer": "No answer from the number",
+    "noanswers": "No answer from the number",
+    "noanswering": "No answer from the number",
+    "noans": "No answer from the number",
+
+    "air": "On the way to airport",
+    "done": "Order delivery completed",
+}
+
+NO_ANSWER_KEYS = {"no", "noanswer", "noanswers", "noanswering", "noans"}
+
+# Order history stores a status as its position in this tuple.
+# Only ever append to it: reordering would change what saved history means.
+STATUS_CODES = (
+    "Pending",
+    "Out for delivery",
+    "On the way to Hulhumale'",
+    "Received by Hulhumale' agents",
+    "No answer from the number",
+    "On the way to airport",
+    "Order delivery completed",
+)
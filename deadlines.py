@@ -0,0 +1,43 @@
+import heapq
+
+
+# ----------------------------
+# STALE ORDER DEADLINES
+# ----------------------------
+class StaleOrders:
+    """When each order should have left its current status, soonest first.
+
+    `limits` maps a status to the seconds an order may stay in it. The store
+    push()es an order every time it enters a status with a limit; entries
+    sit in a heap ordered by deadline, so due() only touches the orders
+    that are actually overdue, never the whole day. An entry whose order
+    has been updated since (its seq changed) is dropped when it surfaces
+    instead of being searched for, and each status an order enters is
+    reported at most once.
+    """
+
+    def __init__(self, limits: dict = None):
+        self.limits = limits or {}
+        self._heap = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, oid: str, info: dict):
+        limit = self.limits.get(info.get("status"))
+        if limit is not None:
+            heapq.heappush(self._heap, (info["ts"] + limit, info["seq"], oid))
+
+    def due(self, orders: dict, now: float) -> list:
+        """(oid, info) of orders still in the status whose deadline passed by `now`."""
+        heap = self._heap
+        found = {}
+        while heap and heap[0][0] <= now:
+            _, seq, oid = heapq.heappop(heap)
+            info = orders.get(oid)
+            if info is not None and info["seq"] == seq:
+                found[oid] = info
+        return list(found.items())
+
+    def clear(self):
+        self._heap = []
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+
+
+def message_key(message) -> str:
+    return f"{message.chat.id}:{message.message_id}"
+
+
+# ----------------------------
+# PROCESSED MESSAGES
+# ----------------------------
+class ProcessedMessages:
+    """Chat messages whose orders have already been applied.
+
+    Telegram can deliver the same message twice (a webhook retry, or
+    updates fetched again after a restart); the store checks this cache so
+    the second copy changes nothing. Each entry, keyed by message_key(),
+    keeps when the message was applied, its status and the orders it
+    named, which is what an edit of the message is compared against.
+
+    At most `size` entries are kept and each is forgotten `ttl` seconds
+    after it was last applied, least recently applied first.
+    """
+
+    def __init__(self, size: int = 10000, ttl: float = 172800):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        """(ts, status, orders) for a message applied within the TTL, else None."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time() - self.ttl:
+            return None
+        return entry
+
+    def add(self, key: str, ts: int, status: str, orders: list):
+        self._entries[key] = (ts, status, list(orders))
+        self._entries.move_to_end(key)
+        self.expire()
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        entries = self._entries
+        while entries and (len(entries) > self.size or next(iter(entries.values()))[0] <= cutoff):
+            entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def dump(self) -> list:
+        return [[key, ts, status, orders] for key, (ts, status, orders) in self._entries.items()]
+
+    def restore(self, rows: list):
+        self._entries.clear()
+        for key, ts, status, orders in rows:
+            self._entries[key] = (ts, status, list(orders))
+        self.expire()
@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a quick dict update to a slow Telegram call.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ----------------------------
+# REGISTRY
+# ----------------------------
+class Registry:
+    """Counters, latency histograms and gauges in Prometheus' text format.
+
+    Recording a sample is a dict lookup and an add, so the instrumentation
+    can stay on in production. Samples also come from the storage threads,
+    so recording and render() share a lock. Gauges are callables read at
+    scrape time.
+    """
+
+    def __init__(self, prefix: str = "baluchi"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            entry[0][bucket] += 1
+            entry[1] += seconds
+
+    def gauge(self, name: str, read, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = read
+
+    def timed(self, name: str, **labels):
+        """Observe how long a `with` block takes; exceptions also count into <name>_errors_total."""
+        return _Timer(self, name, labels)
+
+    def instrument(self, name: str, **labels):
+        """Decorator form of timed() for coroutine functions."""
+        def decorate(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timed(name, **labels):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(counts), total)) for key, (counts, total) in self.histograms.items())
+        lines = []
+        described = set()
+
+        def header(name: str, kind: str, base: str):
+            if name not in described:
+                described.add(name)
+                if base in self.help:
+                    lines.append(f"# HELP {name} {self.help[base]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            full = f"{self.prefix}_{name}"
+            header(full, "counter", name)
+            lines.append(f"{full}{_labels(labels)} {value}")
+
+        for (name, labels), read in sorted(self.gauges.items(), key=lambda item: item[0]):
+            full = f"{self.prefix}_{name}"
+            header(full, "gauge", name)
+            try:
+                lines.append(f"{full}{_labels(labels)} {read()}")
+            except Exception:
+                logger.exception("Could not read gauge %s", full)
+
+        for (name, labels), (counts, total) in histograms:
+            full = f"{self.prefix}_{name}"
+            header(full, "histogram", name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{full}_sum{_labels(labels)} {total}")
+            lines.append(f"{full}_count{_labels(labels)} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: Registry, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(f"{self.name}_seconds", time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.registry.inc(f"{self.name}_errors_total", error=exc_type.__name__, **self.labels)
+        return False
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+gauge = REGISTRY.gauge
+timed = REGISTRY.timed
+instrument = REGISTRY.instrument
+
+REGISTRY.describe("handler_seconds", "Time spent in a bot handler or job.")
+REGISTRY.describe("handler_errors_total", "Handler or job runs that raised, by exception type.")
+REGISTRY.describe("storage_seconds", "Time spent in order storage, by operation.")
+REGISTRY.describe("storage_errors_total", "Order storage operations that raised.")
+REGISTRY.describe("telegram_seconds", "Time spent in Telegram Bot API calls, by method.")
+REGISTRY.describe("telegram_errors_total", "Telegram Bot API calls that failed, by method and error.")
+REGISTRY.describe("lifecycle_seconds", "Time to start up (load stores), drain outgoing messages and flush on shutdown.")
+
+
+def handler(func):
+    """Time a bot handler or job as handler_seconds{handler="<function name>"}."""
+    return instrument("handler", handler=func.__name__)(func)
+
+
+# ----------------------------
+# /metrics ENDPOINT
+# ----------------------------
+class MetricsServer:
+    """Serves GET /metrics on a local port from the bot's own event loop."""
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            method, path = request.split(b" ", 2)[:2]
+            if method == b"GET" and path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,342 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from metrics import timed
+from parsing import join_orders
+from store import FileWriter, read_json
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+# ----------------------------
+# OUTBOUND LOG QUEUE
+# ----------------------------
+class LogSender:
+    """Sends channel log messages from one background worker per chat.
+
+    post() only enqueues, so handlers never wait on Telegram. A chat's
+    worker collects everything that arrives within `window` seconds, joins
+    the messages into as few sends as fit in Telegram's length limit, keeps
+    at least `min_interval` seconds between sends and sleeps through
+    RetryAfter before trying again. A throttled chat only holds up its own
+    messages.
+    """
+
+    def __init__(self, window: float = 2.0, min_interval: float = 3.0, max_retries: int = 5):
+        self.window = window
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.bot = None
+        self._running = False
+        self._queues = {}
+        self._tasks = {}
+        self._last_sent = {}
+        self._sending = {}
+
+    @property
+    def depth(self) -> int:
+        """Posts still queued plus merged messages of the current batches not sent yet."""
+        return sum(q.qsize() for q in self._queues.values()) + sum(map(len, self._sending.values()))
+
+    def start(self, bot):
+        self.bot = bot
+        self._running = True
+        for chat_id in self._queues:
+            self._start_worker(chat_id)
+
+    async def stop(self):
+        """Send whatever is still queued, then stop the workers."""
+        self._running, tasks = False, self._tasks
+        self._tasks = {}
+        for chat_id in tasks:
+            self._queues[chat_id].put_nowait(None)
+        await asyncio.gather(*tasks.values())
+
+    def post(self, chat_id: int, text: str, parse_mode: str = None):
+        if chat_id not in self._queues:
+            self._queues[chat_id] = asyncio.Queue()
+        self._queues[chat_id].put_nowait((chat_id, text, parse_mode))
+        if self._running:
+            self._start_worker(chat_id)
+
+    def _start_worker(self, chat_id: int):
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._run(chat_id))
+
+    async def _run(self, chat_id: int):
+        queue = self._queues[chat_id]
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    await self._send_batch(chat_id, batch)
+                    return
+                batch.append(item)
+            await self._send_batch(chat_id, batch)
+
+    async def _send_batch(self, chat_id: int, batch: list):
+        sending = self._sending[chat_id] = coalesce(batch)
+        while sending:
+            _, parts, parse_mode = sending[0]
+            sent = await self._send(chat_id, "\n\n".join(parts), parse_mode)
+            sending.pop(0)
+            if not sent and len(parts) > 1:
+                # One malformed post rejects the whole merge; retry the posts on their own.
+                sending[:0] = [(chat_id, [part], parse_mode) for part in parts]
+
+    async def _send(self, chat_id: int, text: str, parse_mode: str) -> bool:
+        """Send one message; returns False only if Telegram rejected it as malformed."""
+        wait = self._last_sent.get(chat_id, 0) + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        for attempt in range(self.max_retries):
+            try:
+                with timed("telegram", method="send_message"):
+                    await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                break
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                await asyncio.sleep(delay)
+            except BadRequest:
+                logger.exception("Telegram rejected log message to %s", chat_id)
+                self._last_sent[chat_id] = time.monotonic()
+                return False
+            except NetworkError:
+                await asyncio.sleep(2 ** attempt)
+            except Exception:
+                logger.exception("Dropping log message to %s", chat_id)
+                break
+        else:
+            logger.error("Giving up on log message to %s after %d attempts", chat_id, self.max_retries)
+
+        self._last_sent[chat_id] = time.monotonic()
+        return True
+
+
+def coalesce(batch: list) -> list:
+    """Group queued (chat_id, text, parse_mode) items into as few messages as fit.
+
+    Returns (chat_id, parts, parse_mode) tuples; the parts are joined when sent.
+    """
+    merged = []
+    current = {}
+    for chat_id, text, parse_mode in batch:
+        key = (chat_id, parse_mode)
+        parts = current.get(key)
+        if parts and sum(len(p) + 2 for p in parts) + len(text) > MAX_MESSAGE_LENGTH:
+            merged.append((chat_id, parts, parse_mode))
+            parts = None
+        if parts is None:
+            parts = current[key] = []
+        parts.append(text)
+    for (chat_id, parse_mode), parts in current.items():
+        merged.append((chat_id, parts, parse_mode))
+    return merged
+
+
+# ----------------------------
+# ADMIN NOTIFICATIONS
+# ----------------------------
+class AdminNotifier:
+    """Sends NO ANSWER alerts to every admin at once.
+
+    The first alert after a quiet spell goes out immediately. Alerts that
+    follow within `window` seconds are collected and sent as one digest
+    when the window closes, and an order already alerted within the window
+    is not repeated. Failed deliveries are counted per recipient in
+    `failures` instead of being swallowed.
+    """
+
+    def __init__(self, recipients: list, window: float = 60.0, concurrency: int = 5):
+        self.recipients = recipients
+        self.window = window
+        self.concurrency = concurrency
+        self.failures = {}
+        self._recent = {}
+        self._pending = []
+        self._digest_task = None
+        self._sends = set()
+        self._bot = None
+
+    def alert(self, bot, orders: list, agent_name: str):
+        if not orders or not self.recipients:
+            return
+        self._bot = bot
+
+        now = time.monotonic()
+        fresh = [oid for oid in orders if now - self._recent.get(oid, -self.window) >= self.window]
+        if not fresh:
+            return
+        for oid in fresh:
+            self._recent[oid] = now
+
+        if self._digest_task is None:
+            msg = f"⚠️ Orders {join_orders(fresh)} marked as NO ANSWER by {agent_name}"
+            task = asyncio.create_task(self.send_all(msg))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+            self._digest_task = asyncio.create_task(self._digest_loop())
+        else:
+            self._pending.append((fresh, agent_name))
+
+    async def _digest_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.window)
+                if not self._pending:
+                    break
+                await self._send_digest()
+        finally:
+            self._digest_task = None
+            cutoff = time.monotonic() - self.window
+            self._recent = {oid: at for oid, at in self._recent.items() if at > cutoff}
+
+    async def _send_digest(self):
+        pending, self._pending = self._pending, []
+        lines = ["⚠️ NO ANSWER digest:"]
+        lines += [f"- Orders {join_orders(orders)} by {agent_name}" for orders, agent_name in pending]
+        await self.send_all("\n".join(lines))
+
+    async def send_all(self, text: str):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _one(chat_id):
+            async with semaphore:
+                try:
+                    with timed("telegram", method="send_message"):
+                        await self._bot.send_message(chat_id=chat_id, text=text)
+                except Exception as e:
+                    entry = self.failures.setdefault(chat_id, {"count": 0, "last_error": None})
+                    entry["count"] += 1
+                    entry["last_error"] = f"{type(e).__name__}: {e}"
+                    logger.warning("Admin alert to %s failed: %s", chat_id, e)
+
+        await asyncio.gather(*(_one(chat_id) for chat_id in self.recipients))
+
+    async def stop(self):
+        """Send any digest still waiting for its window to close."""
+        if self._digest_task is not None:
+            self._digest_task.cancel()
+            try:
+                await self._digest_task
+            except asyncio.CancelledError:
+                pass
+        if self._pending:
+            await self._send_digest()
+        if self._sends:
+            await asyncio.gather(*self._sends)
+
+
+# ----------------------------
+# DELETION SCHEDULER
+# ----------------------------
+class DeletionScheduler:
+    """Deletes temporary replies once their timeout has passed.
+
+    Pending deletions live in one heap ordered by due time and are drained
+    by a single task. Everything that falls due within `resolution` seconds
+    of the head is deleted together, one delete_messages call per chat.
+    flush() saves the heap to `path` on the scheduler's own writer thread,
+    so after a restart start() picks the pending deletions back up.
+    """
+
+    BATCH_LIMIT = 100  # delete_messages accepts at most 100 IDs per call
+
+    def __init__(self, path: str, resolution: float = 1.0):
+        self.path = path
+        self.resolution = resolution
+        self.bot = None
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._dirty = False
+        self._task = None
+        self.writer = FileWriter()
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+
+    def start(self, bot):
+        self.bot = bot
+        self._heap = [tuple(entry) for entry in read_json(self.path).get("pending", [])]
+        heapq.heapify(self._heap)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        entry = (time.time() + delay, chat_id, message_id)
+        heapq.heappush(self._heap, entry)
+        self._dirty = True
+        if self._heap[0] is entry:
+            self._wake.set()
+
+    def flush(self):
+        if self._dirty:
+            self.writer.write_json(self.path, {"pending": list(self._heap)})
+            self._dirty = False
+
+    async def stop(self, drain_within: float = 0):
+        """Stop the worker, delete what falls due within `drain_within` seconds and save the rest for next start."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            if drain_within and self.bot is not None:
+                await self._delete(self._pop_due(drain_within))
+        finally:
+            self.flush()
+            await asyncio.to_thread(self.writer.wait)
+
+    def _pop_due(self, within: float = None) -> dict:
+        cutoff = time.time() + (self.resolution if within is None else within)
+        by_chat = {}
+        while self._heap and self._heap[0][0] <= cutoff:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            by_chat.setdefault(chat_id, []).append(message_id)
+        if by_chat:
+            self._dirty = True
+        return by_chat
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            wait = self._heap[0][0] - time.time() if self._heap else None
+            if wait is None or wait > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._delete(self._pop_due())
+
+    async def _delete(self, by_chat: dict):
+        for chat_id, message_ids in by_chat.items():
+            for i in range(0, len(message_ids), self.BATCH_LIMIT):
+                try:
+                    with timed("telegram", method="delete_messages"):
+                        await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids[i:i + self.BATCH_LIMIT])
+                except Exception as e:
+                    logger.debug("Could not delete messages in %s: %s", chat_id, e)
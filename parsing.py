@@ -0,0 +1,292 @@
+import re
+import string
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+
+from config import MAX_BULK_ORDERS, STATUS_MAP, NO_ANSWER_KEYS
+
+# ----------------------------
+# PATTERNS / ALIASES
+# ----------------------------
+SEPARATORS = re.compile(r"[,/ ]+")
+RANGE_DASH = re.compile(r"(?<=\d)\s*-\s*(?=\d)")  # "101 - 160" -> "101-160"
+
+ORDER_CHARS = "0123456789 ,/-"
+# Letters as [a-zA-Z] matches them with re.IGNORECASE, which adds four
+# non-ASCII ones that case-fold to ASCII (İ, ı, ſ, K).
+STATUS_CHARS = string.ascii_letters + " _-" + "\u0130\u0131\u017f\u212a"
+
+_STRIP_KEY = str.maketrans("", "", " -_")
+
+
+def split_status(text: str):
+    """Split a stripped "<orders> <status>" into its two parts, or return None.
+
+    Picks the same split as ^([0-9 ,/-]+)\s+([a-zA-Z _-]+)$ with greedy
+    groups, but in linear time: spaces and dashes fit both parts, so that
+    pattern backtracks quadratically (or worse) on long runs of them.
+    """
+    head = len(text) - len(text.lstrip(ORDER_CHARS))  # text[:head] is the longest run that could be orders
+    tail = len(text.rstrip(STATUS_CHARS))  # text[tail:] is the longest run that could be a status
+
+    # The orders end at the last whitespace the run allows. Cutting earlier
+    # only moves the status start left, so it never helps.
+    if head < len(text) and text[head].isspace():
+        cut, start = head, head + 1
+        while text[start].isspace():
+            start += 1
+    else:
+        cut = text.rfind(" ", 0, head)
+        start = cut + 1
+    if cut < 1 or start < tail:
+        return None
+    return text[:cut], text[start:]
+
+
+def normalize_status_key(text: str) -> str:
+    return text.lower().translate(_STRIP_KEY)
+
+
+# Status keys as they look after normalize_status_key(), so a message's key
+# is resolved with one dict lookup.
+STATUS_ALIASES = {normalize_status_key(key): status for key, status in STATUS_MAP.items()}
+
+
+# ----------------------------
+# TYPO-TOLERANT STATUS LOOKUP
+# ----------------------------
+def _deletions(word: str, depth: int) -> set:
+    """Every string reachable from `word` by deleting up to `depth` characters."""
+    found = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance counting an adjacent swap as one edit."""
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class StatusResolver:
+    """Maps status keys, including typos, to a canonical status.
+
+    Known keys are a dict hit. Unknown keys of at least `min_length`
+    characters are matched against a deletion-neighbourhood index built
+    once: one edit is tolerated up to 5 characters, two beyond that. Keys
+    shorter than 3 characters ("no", "on") and keys of the `exact_only`
+    statuses are never fuzzy targets, and a typo whose closest keys point
+    at different statuses is refused.
+    """
+
+    def __init__(self, aliases: dict, min_length: int = 4, max_distance: int = 2, exact_only: tuple = ()):
+        self.aliases = aliases
+        self.min_length = min_length
+        self.max_distance = max_distance
+        # Nothing longer can be within max_distance of an alias, and the
+        # deletion neighbourhood of a long key is far too big to build.
+        self.max_length = max(map(len, aliases), default=0) + max_distance
+        self._index = {}
+        for key, status in aliases.items():
+            if len(key) >= 3 and status not in exact_only:
+                for variant in _deletions(key, max_distance):
+                    self._index.setdefault(variant, set()).add(key)
+        self.resolve = lru_cache(maxsize=1024)(self._resolve)
+
+    def distance_limit(self, key: str) -> int:
+        return min(1 if len(key) <= 5 else 2, self.max_distance)
+
+    def _resolve(self, key: str):
+        """Return the alias `key` stands for, or None if unknown or ambiguous."""
+        if key in self.aliases:
+            return key
+        if len(key) < self.min_length or len(key) > self.max_length:
+            return None
+
+        limit = self.distance_limit(key)
+        candidates = set()
+        for variant in _deletions(key, limit):
+            candidates |= self._index.get(variant, set())
+
+        best, matches = limit, []
+        for candidate in candidates:
+            distance = _edit_distance(key, candidate)
+            if distance > best:
+                continue
+            if distance < best or not matches:
+                best, matches = distance, [candidate]
+            elif distance == best:
+                matches.append(candidate)
+
+        if not matches or len({self.aliases[m] for m in matches}) > 1:
+            return None
+        return min(matches)
+
+
+# Done can only be undone by an admin, so it has to be typed out.
+status_resolver = StatusResolver(STATUS_ALIASES, exact_only=(STATUS_MAP["done"],))
+
+
+# ----------------------------
+# MESSAGE CLASSIFIER
+# ----------------------------
+class Kind(Enum):
+    NONE = "none"
+    REPLY = "reply"          # status word replying to a list of orders
+    DONE_ALL = "done_all"    # "done" on its own
+    OUT = "out"              # bare order numbers
+    DONE = "done"            # "123/45 done"
+    STATUS = "status"        # "123 otw", "1080 no", "101-160 otw", ...
+    TOO_MANY = "too_many"    # names more than MAX_BULK_ORDERS orders
+
+
+@dataclass(frozen=True)
+class ParsedMessage:
+    kind: Kind
+    orders: tuple = ()
+    status: str = None
+    key: str = None
+    typo: str = None  # the word as typed, when it only matched by typo
+
+    @property
+    def no_answer(self) -> bool:
+        return self.key in NO_ANSWER_KEYS
+
+
+NOTHING = ParsedMessage(Kind.NONE)
+TOO_MANY = ParsedMessage(Kind.TOO_MANY)
+
+
+# ----------------------------
+# ORDER LISTS AND RANGES
+# ----------------------------
+class TooManyOrders(ValueError):
+    """A message names more than MAX_BULK_ORDERS orders."""
+
+
+def split_orders(text: str, strict: bool = False) -> list:
+    """Order IDs in `text`, with ranges like "101-160" expanded in place.
+
+    Other tokens are skipped, or with `strict` make the whole text not an
+    order list (None). Raises TooManyOrders past MAX_BULK_ORDERS IDs, so a
+    mistyped range can't stamp thousands of orders.
+    """
+    if "-" in text:
+        text = RANGE_DASH.sub("-", text)
+    orders = []
+    for token in SEPARATORS.split(text):
+        if token.isdigit() and len(token) <= 6:
+            orders.append(token)
+            continue
+        first, dash, last = token.partition("-")
+        if dash and first.isdigit() and last.isdigit() and len(first) <= 6 and len(last) <= 6:
+            start, end = int(first), int(last)
+            if start < end:
+                if len(orders) + end - start >= MAX_BULK_ORDERS:
+                    raise TooManyOrders(token)
+                orders.extend(map(str, range(start, end + 1)))
+                continue
+        if strict:
+            return None
+    if len(orders) > MAX_BULK_ORDERS:
+        raise TooManyOrders(len(orders))
+    return orders
+
+
+def join_orders(orders) -> str:
+    """Order IDs as text, with runs of 3+ consecutive IDs written as one range.
+
+    split_orders() reads the result back into the same IDs.
+    """
+    runs = []  # [first, last, count]
+    for oid in orders:
+        if runs and oid == str(int(runs[-1][1]) + 1):
+            runs[-1][1] = oid
+            runs[-1][2] += 1
+        else:
+            runs.append([oid, oid, 1])
+    parts = []
+    for first, last, count in runs:
+        if count >= 3:
+            parts.append(f"{first}-{last}")
+        else:
+            parts.extend((first, last)[:count])
+    return ", ".join(parts)
+
+
+def parse_message(text: str, reply_text: str = None, fuzzy: bool = True) -> ParsedMessage:
+    """Classify a group message and pull out its order IDs.
+
+    `text` is the stripped message; `reply_text` the text of the message it
+    replies to, if any. Order lists may use ranges ("101-160 otw"). With
+    `fuzzy`, a mistyped status after a list of orders ("123 rcvf") is
+    resolved through status_resolver.
+    """
+    try:
+        return _parse(text, reply_text, fuzzy)
+    except TooManyOrders:
+        return TOO_MANY
+
+
+def _parse(text: str, reply_text: str, fuzzy: bool) -> ParsedMessage:
+    if reply_text:
+        key = normalize_status_key(text)
+        status = STATUS_ALIASES.get(key)
+        if status is not None:
+            # Only the reply is this message; a replied-to text naming too
+            # many orders is not an order list.
+            try:
+                replied = split_orders(reply_text.strip())
+            except TooManyOrders:
+                replied = None
+            if replied:
+                return ParsedMessage(Kind.REPLY, tuple(replied), status, key)
+
+    if not text:
+        return NOTHING
+
+    # Bare order lists end in a digit, status updates in a letter, so the
+    # last character decides which of the two shapes to try.
+    if text[-1].isdigit():
+        orders = split_orders(text, strict=True)
+        if orders:
+            return ParsedMessage(Kind.OUT, tuple(orders), STATUS_MAP["out"], "out")
+        return NOTHING
+
+    if len(text) == 4 and text.lower() == "done":
+        return ParsedMessage(Kind.DONE_ALL, (), STATUS_MAP["done"], "done")
+
+    parts = split_status(text)
+    if parts is None:
+        return NOTHING
+
+    orders = split_orders(parts[0])
+    if not orders:
+        return NOTHING
+
+    word = parts[1]
+    if word.lower() == "done":
+        return ParsedMessage(Kind.DONE, tuple(orders), STATUS_MAP["done"], "done")
+
+    key = normalize_status_key(word)
+    status = STATUS_ALIASES.get(key)
+    if status is not None:
+        return ParsedMessage(Kind.STATUS, tuple(orders), status, key)
+
+    alias = status_resolver.resolve(key) if fuzzy else None
+    if alias is None:
+        return NOTHING
+    return ParsedMessage(Kind.STATUS, tuple(orders), STATUS_ALIASES[alias], alias, typo=word)
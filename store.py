@@ -0,0 +1,993 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+try:
+    import orjson
+except ImportError:  # optional; only makes loading and saving faster
+    orjson = None
+
+from agents import AgentRegistry
+from analytics import LatencyStats
+from config import STATUS_MAP, STATUS_CODES
+from deadlines import StaleOrders
+from dedup import ProcessedMessages
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+GMT5 = timezone(timedelta(hours=5))
+STATUS_CODE = {status: code for code, status in enumerate(STATUS_CODES)}
+
+
+def now_gmt5() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(hours=5)
+
+
+def fmt_time(ts: int) -> str:
+    """Render an epoch timestamp in GMT+5; the date is shown unless it is today."""
+    moment = datetime.fromtimestamp(ts, GMT5)
+    if moment.date() == datetime.now(GMT5).date():
+        return moment.strftime("%H:%M")
+    return moment.strftime("%d %b %H:%M")
+
+
+# ----------------------------
+# ORDER HISTORY ENTRIES
+# ----------------------------
+# An order looks like
+#   {"status": str, "agent": str, "agent_id": int, "ts": epoch, "seq": int, "history": [entry, ...]}
+# and every history entry is a compact [seq, ts, status code, agent, agent_id]
+# list. agent_id is the agent's Telegram user ID; orders and entries written
+# before it was recorded (or without a known user) have none, and such
+# entries are four items long. seq increases by one for every change the
+# store makes, so entries with the same ts still have a definite order.
+def make_entry(seq: int, ts: int, status: str, agent: str, agent_id: int = None) -> list:
+    if agent_id is None:
+        return [seq, ts, STATUS_CODE.get(status, 0), agent]
+    return [seq, ts, STATUS_CODE.get(status, 0), agent, agent_id]
+
+
+def unpack_entry(entry: list):
+    """(seq, ts, status, agent) of a history entry."""
+    seq, ts, code, agent = entry[:4]
+    return seq, ts, STATUS_CODES[code], agent
+
+
+def entry_agent_id(entry: list):
+    return entry[4] if len(entry) > 4 else None
+
+
+def _legacy_ts(hhmm: str, now: datetime) -> int:
+    hour, minute = map(int, hhmm.split(":"))
+    moment = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if moment > now:
+        moment -= timedelta(days=1)
+    return int(moment.timestamp())
+
+
+def last_seq(orders: dict) -> int:
+    seq = 0
+    for info in orders.values():
+        history = info.get("history")
+        seq = max(seq, info.get("seq", 0), history[-1][0] if history else 0)
+    return seq
+
+
+def upgrade_orders(orders: dict) -> int:
+    """Convert orders saved with "HH:MM" strings and dict history entries.
+
+    Their times are taken as the most recent such minute. Returns the
+    highest sequence number in `orders` afterwards.
+    """
+    legacy = {oid: info for oid, info in orders.items() if "timestamp" in info}
+    seq = last_seq({oid: info for oid, info in orders.items() if oid not in legacy})
+    now = datetime.now(GMT5)
+    for info in legacy.values():
+        entries = []
+        for h in info.get("history", []):
+            seq += 1
+            entries.append(make_entry(seq, _legacy_ts(h["timestamp"], now), h["status"], h["agent"]))
+        info["history"] = entries
+        info["ts"] = _legacy_ts(info.pop("timestamp"), now)
+        if entries:
+            info["seq"] = entries[-1][0]
+        else:
+            seq += 1
+            info["seq"] = seq
+    return seq
+
+
+def dump_json(data) -> bytes:
+    """Compact UTF-8 JSON, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def read_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return orjson.loads(f.read()) if orjson is not None else json.load(f)
+
+
+def write_json(path: str, data: dict):
+    """Write via a temp file and rename so a crash never leaves half a file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(dump_json(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ----------------------------
+# WRITER THREAD
+# ----------------------------
+class FileWriter:
+    """The one thread all of a store's files are written from, in submission order.
+
+    Serializing and writing happen on the thread, so a big orders file
+    never stalls the event loop. Callers must hand over data that nothing
+    changes afterwards, such as OrderStore.snapshot().
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+
+    def submit(self, func, *args):
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._report_error)
+        return future
+
+    def write_json(self, path: str, data):
+        return self.submit(self._write_json, path, data)
+
+    @staticmethod
+    def _write_json(path: str, data):
+        with timed("storage", op="write"):
+            write_json(path, data)
+
+    @staticmethod
+    def _report_error(future):
+        if future.exception():
+            logger.error("Storage write failed", exc_info=future.exception())
+
+    def wait(self):
+        """Block until everything submitted so far has been written."""
+        self._executor.submit(lambda: None).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+# ----------------------------
+# BACKENDS
+# ----------------------------
+class JsonBackend:
+    """Rewrites the whole orders file on flush when anything changed.
+
+    The file is written from a snapshot on the store's writer thread; a
+    flush while the previous write is still running is left to the next
+    one. The processed-messages cache goes to `processed_file` in the same
+    write.
+    """
+
+    def __init__(self, data_file: str, processed_file: str = None):
+        self.data_file = data_file
+        self.processed_file = processed_file
+        self._dirty = False
+        self._writing = None
+
+    def load(self, store):
+        store.orders = read_json(self.data_file)
+        if self.processed_file and os.path.exists(self.processed_file):
+            with open(self.processed_file, "r") as f:
+                store.processed.restore(json.load(f))
+
+    def record(self, store, event: dict):
+        self._dirty = True
+
+    def flush(self, store):
+        if not self._dirty or (self._writing is not None and not self._writing.done()):
+            return
+        self._dirty = False
+        self._writing = store.writer.submit(self._write, store.snapshot(), store.processed.dump())
+        self._writing.add_done_callback(self._retry_failed)
+
+    def _write(self, orders: dict, processed: list):
+        with timed("storage", op="write"):
+            write_json(self.data_file, orders)
+            if self.processed_file:
+                write_json(self.processed_file, processed)
+
+    def _retry_failed(self, future):
+        if future.exception():
+            self._dirty = True
+
+    def close(self, store):
+        store.writer.wait()
+        self.flush(store)
+
+
+class JournalBackend:
+    """Append-only journal of order events on top of a periodic snapshot.
+
+    Every event is one JSON line, so the cost of an update scales with the
+    update, not with the day's orders. Lines are appended and fsync'd on
+    the store's writer thread; all lines recorded while a write is running
+    go out together in the next write and fsync. Once `compact_every`
+    events have piled up, flush() has the writer fold them into the
+    snapshot and truncate the journal. Events carry a sequence number and
+    the snapshot records the last one it contains, so replay after a crash
+    between the two steps never applies an event twice.
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: str, compact_every: int, seed_file: str = None):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.seed_file = seed_file
+        self.seq = 0
+        self.pending = 0
+        self._fd = None
+        self._lock = threading.Lock()
+        self._buffer = None  # lines waiting for the writer
+
+    def load(self, store):
+        if os.path.exists(self.snapshot_file):
+            snapshot = read_json(self.snapshot_file)
+            store.orders = snapshot.get("orders", {})
+            store.processed.restore(snapshot.get("processed", []))
+            self.seq = snapshot.get("seq", 0)
+        elif self.seed_file:
+            # First start in journal mode: take over the plain JSON file.
+            store.orders = read_json(self.seed_file)
+        store.seq = upgrade_orders(store.orders)
+
+        snapshot_seq = self.seq
+        self.pending = 0
+        good = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "rb") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break  # torn final write
+                    good += len(line)
+                    if event["seq"] <= snapshot_seq:
+                        continue
+                    store.replay(event)
+                    self.seq = event["seq"]
+                    self.pending += 1
+            # Cut off a torn tail so new events don't get glued onto it.
+            if good < os.path.getsize(self.journal_file):
+                os.truncate(self.journal_file, good)
+
+        self._fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def record(self, store, event: dict):
+        self.seq += 1
+        line = dump_json({"seq": self.seq, **event}) + b"\n"
+        with self._lock:
+            if self._buffer is None:
+                self._buffer = []
+                store.writer.submit(self._append, self._buffer)
+            self._buffer.append(line)
+        self.pending += 1
+
+    def _append(self, buffer: list):
+        with self._lock:
+            if self._buffer is buffer:
+                self._buffer = None
+            data = b"".join(buffer)
+        with timed("storage", op="journal_append"):
+            os.write(self._fd, data)
+            os.fsync(self._fd)
+
+    def compact(self, store):
+        with self._lock:
+            # Lines recorded so far are written by their own job, which runs before this one.
+            self._buffer = None
+        snapshot = {"seq": self.seq, "orders": store.snapshot(), "processed": store.processed.dump()}
+        store.writer.submit(self._compact, snapshot)
+        self.pending = 0
+
+    def _compact(self, snapshot: dict):
+        with timed("storage", op="compact"):
+            write_json(self.snapshot_file, snapshot)
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+
+    def flush(self, store):
+        if self.pending >= self.compact_every:
+            self.compact(store)
+
+    def close(self, store):
+        if self._fd is None:
+            return
+        if self.pending:
+            self.compact(store)
+        store.writer.wait()
+        os.close(self._fd)
+        self._fd = None
+
+
+class SqliteBackend:
+    """Orders in SQLite, indexed by agent and current status.
+
+    One connection in WAL mode is owned by a single worker thread; writes
+    and queries are queued onto it, so nothing touches the disk on the
+    event loop and a query always sees every write recorded before it.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            agent TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            agent_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS orders_agent ON orders (agent, status);
+        CREATE INDEX IF NOT EXISTS orders_status ON orders (status);
+        CREATE TABLE IF NOT EXISTS history (
+            seq INTEGER PRIMARY KEY,
+            order_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            agent TEXT NOT NULL,
+            agent_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS history_ts ON history (ts);
+        CREATE INDEX IF NOT EXISTS history_order ON history (order_id);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS processed (
+            key TEXT PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            orders TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS processed_ts ON processed (ts);
+    """
+
+    def __init__(self, db_file: str, seed_file: str = None):
+        self.db_file = db_file
+        self.seed_file = seed_file
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.db_file)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        legacy = self._read_legacy()
+        self._conn.executescript(self.SCHEMA)
+        self._add_agent_ids()
+        if legacy is not None:
+            upgrade_orders(legacy)
+            with self._conn:
+                self._insert(legacy)
+
+    def _read_legacy(self):
+        """Orders from a database that still has "HH:MM" timestamp columns.
+
+        The old tables are dropped so SCHEMA can recreate them; returns None
+        if there is nothing to upgrade.
+        """
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(orders)")]
+        if "timestamp" not in columns:
+            return None
+        orders = {}
+        for oid, status, agent, timestamp in self._conn.execute(
+            "SELECT id, status, agent, timestamp FROM orders ORDER BY rowid"
+        ):
+            orders[oid] = {"status": status, "timestamp": timestamp, "agent": agent, "history": []}
+        for oid, status, agent, timestamp in self._conn.execute(
+            "SELECT order_id, status, agent, timestamp FROM history ORDER BY seq"
+        ):
+            if oid in orders:
+                orders[oid]["history"].append({"status": status, "agent": agent, "timestamp": timestamp})
+        with self._conn:
+            self._conn.execute("DROP TABLE orders")
+            self._conn.execute("DROP TABLE history")
+        return orders
+
+    def _add_agent_ids(self):
+        """Add the agent_id columns to a database created before they existed."""
+        with self._conn:
+            for table in ("orders", "history"):
+                columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+                if "agent_id" not in columns:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN agent_id INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS orders_agent_id ON orders (agent_id, status)")
+
+    def _insert(self, orders: dict):
+        for oid, info in orders.items():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO orders (id, status, agent, ts, seq, agent_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (oid, info["status"], info["agent"], info["ts"], info["seq"], info.get("agent_id")),
+            )
+            self._conn.executemany(
+                "INSERT INTO history (seq, order_id, ts, status, agent, agent_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [(h[0], oid, h[1], h[2], h[3], entry_agent_id(h)) for h in info.get("history", [])],
+            )
+
+    def _migrate(self):
+        """Import orders.json the first time the database is opened."""
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        data = read_json(self.seed_file) if self.seed_file else {}
+        upgrade_orders(data)
+        with self._conn:
+            self._insert(data)
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (self.seed_file or "",))
+
+    def _read_all(self) -> dict:
+        orders = {}
+        for oid, status, agent, ts, seq, agent_id in self._conn.execute(
+            "SELECT id, status, agent, ts, seq, agent_id FROM orders ORDER BY rowid"
+        ):
+            orders[oid] = {"status": status, "agent": agent, "agent_id": agent_id, "ts": ts, "seq": seq, "history": []}
+        for seq, oid, ts, code, agent, agent_id in self._conn.execute(
+            "SELECT seq, order_id, ts, status, agent, agent_id FROM history ORDER BY seq"
+        ):
+            if oid in orders:
+                orders[oid]["history"].append([seq, ts, code, agent] if agent_id is None else [seq, ts, code, agent, agent_id])
+        return orders
+
+    def _read_processed(self) -> list:
+        return [
+            [key, ts, status, json.loads(orders)]
+            for key, ts, status, orders in self._conn.execute(
+                "SELECT key, ts, status, orders FROM processed ORDER BY ts"
+            )
+        ]
+
+    def load(self, store):
+        def _load():
+            self._open()
+            self._migrate()
+            return self._read_all(), self._read_processed()
+
+        store.orders, processed = self._executor.submit(_load).result()
+        store.processed.restore(processed)
+
+    def _write(self, statements: list):
+        with timed("storage", op="sqlite_write"), self._conn:
+            for sql, rows in statements:
+                self._conn.executemany(sql, rows)
+
+    def record(self, store, event: dict):
+        op = event["op"]
+        statements = []
+        if op == "status":
+            # One row per order, written with one executemany per table, so
+            # a bulk update of hundreds of orders is still one short transaction.
+            code = STATUS_CODE.get(event["status"], 0)
+            status, agent, ts, agent_id = event["status"], event["agent"], event["ts"], event.get("agent_id")
+            ids = list(enumerate(event["ids"], start=event["order_seq"]))
+            statements.append((
+                "INSERT INTO orders (id, status, agent, ts, seq, agent_id) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET status = excluded.status, agent = excluded.agent, "
+                "ts = excluded.ts, seq = excluded.seq, agent_id = excluded.agent_id",
+                [(oid, status, agent, ts, seq, agent_id) for seq, oid in ids],
+            ))
+            statements.append((
+                "INSERT INTO history (seq, order_id, ts, status, agent, agent_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [(seq, oid, ts, code, agent, agent_id) for seq, oid in ids],
+            ))
+            if "msg" in event:
+                statements.append((
+                    "INSERT OR REPLACE INTO processed (key, ts, status, orders) VALUES (?, ?, ?, ?)",
+                    [(event["msg"], ts, status, json.dumps(event["msg_orders"]))],
+                ))
+        elif op == "undone":
+            info = store.orders[event["id"]]
+            statements.append((
+                "UPDATE orders SET status = ?, agent = ?, ts = ?, seq = ?, agent_id = ? WHERE id = ?",
+                [(info["status"], info["agent"], info["ts"], info["seq"], info.get("agent_id"), event["id"])],
+            ))
+        elif op == "clear":
+            statements.append(("DELETE FROM orders", [()]))
+            statements.append(("DELETE FROM history", [()]))
+
+        future = self._executor.submit(self._write, statements)
+        future.add_done_callback(self._report_error)
+
+    @staticmethod
+    def _report_error(future):
+        if future.exception():
+            logger.error("SQLite write failed", exc_info=future.exception())
+
+    def _select(self, agent, agent_id, status, exclude_status) -> list:
+        sql = "SELECT id FROM orders WHERE 1 = 1"
+        params = []
+        if agent is not None:
+            sql += " AND agent = ?"
+            params.append(agent)
+        if agent_id is not None:
+            sql += " AND agent_id = ?"
+            params.append(agent_id)
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        if exclude_status is not None:
+            sql += " AND status != ?"
+            params.append(exclude_status)
+        return [row[0] for row in self._conn.execute(sql + " ORDER BY rowid", params)]
+
+    async def select(self, agent=None, agent_id=None, status=None, exclude_status=None) -> list:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._select, agent, agent_id, status, exclude_status)
+
+    def assign_agent_ids(self, ids: dict):
+        """Fill in agent_id for orders recorded before it was, from agent name -> user ID."""
+        self._executor.submit(self._write, [
+            ("UPDATE orders SET agent_id = ? WHERE agent = ? AND agent_id IS NULL",
+             [(uid, name) for name, uid in ids.items()]),
+        ]).result()
+
+    def flush(self, store):
+        # Keep the processed table to what the in-memory cache still holds.
+        cutoff = int(time.time() - store.processed.ttl)
+        future = self._executor.submit(self._write, [
+            ("DELETE FROM processed WHERE ts <= ?", [(cutoff,)]),
+            ("DELETE FROM processed WHERE key NOT IN (SELECT key FROM processed ORDER BY ts DESC LIMIT ?)",
+             [(store.processed.size,)]),
+        ])
+        future.add_done_callback(self._report_error)
+
+    def close(self, store):
+        if self._conn is None:
+            return
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
+        self._conn = None
+
+
+# ----------------------------
+# AGGREGATE COUNTERS
+# ----------------------------
+class Aggregate:
+    """Order counts by current status, overall and per agent.
+
+    The store adds an order's (agent, status) when it enters the indexes
+    and removes it when it leaves, so reading the totals is O(agents).
+    Per-agent counts are kept by name, for the breakdowns, and by user ID
+    for an agent's own stats.
+    """
+
+    def __init__(self):
+        self.by_status = {}
+        self.by_agent = {}
+        self.by_agent_id = {}
+
+    def _agent_counts(self, info: dict):
+        yield self.by_agent, info.get("agent", "Unknown")
+        if info.get("agent_id") is not None:
+            yield self.by_agent_id, info["agent_id"]
+
+    def add(self, info: dict):
+        status = info.get("status", "")
+        self.by_status[status] = self.by_status.get(status, 0) + 1
+        for index, key in self._agent_counts(info):
+            counts = index.setdefault(key, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def remove(self, info: dict):
+        status = info.get("status", "")
+        self._decrement(self.by_status, status)
+        for index, key in self._agent_counts(info):
+            counts = index.get(key)
+            if counts is not None:
+                self._decrement(counts, status)
+                if not counts:
+                    del index[key]
+
+    @staticmethod
+    def _decrement(counts: dict, key: str):
+        if key not in counts:
+            return
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
+
+    def clear(self):
+        self.by_status = {}
+        self.by_agent = {}
+        self.by_agent_id = {}
+
+    @staticmethod
+    def _summarize(counts: dict) -> dict:
+        total = sum(counts.values())
+        done = counts.get(STATUS_MAP["done"], 0)
+        no_answer = counts.get(STATUS_MAP["no"], 0)
+        return {"total": total, "done": done, "no_answer": no_answer, "in_progress": total - done - no_answer}
+
+    def summary(self, agent: str = None, agent_id: int = None) -> dict:
+        """Total / done / no_answer / in_progress, overall or for one agent (by name or user ID)."""
+        if agent_id is not None:
+            return self._summarize(self.by_agent_id.get(agent_id, {}))
+        if agent is None:
+            return self._summarize(self.by_status)
+        return self._summarize(self.by_agent.get(agent, {}))
+
+    def agents(self) -> dict:
+        """Per-agent {"total", "done"} breakdown."""
+        return {
+            agent: {"total": sum(counts.values()), "done": counts.get(STATUS_MAP["done"], 0)}
+            for agent, counts in self.by_agent.items()
+        }
+
+    def verify(self, orders: dict):
+        """Recompute from scratch and assert the running counters agree."""
+        fresh = Aggregate()
+        for info in orders.values():
+            fresh.add(info)
+        assert fresh.by_status == self.by_status, (fresh.by_status, self.by_status)
+        assert fresh.by_agent == self.by_agent, (fresh.by_agent, self.by_agent)
+        assert fresh.by_agent_id == self.by_agent_id, (fresh.by_agent_id, self.by_agent_id)
+
+
+# ----------------------------
+# ORDER STORE
+# ----------------------------
+class OrderStore:
+    """Orders and agents kept in memory, persisted through a backend.
+
+    Every change to the orders is an event ("status", "undone", "clear")
+    that is applied in memory and handed to the backend; replaying the
+    same events rebuilds the same state. `agents` is the AgentRegistry;
+    flush() writes it back to its own file when it changed.
+
+    Reverse indexes (agent name or user ID -> IDs, status -> IDs) and the `stats`
+    counters are kept up to date by every event, so find() costs O(result)
+    and stats lookups O(agents) instead of O(all orders). With
+    verify=True the counters are re-checked from scratch after each event.
+    `latency` holds time-in-status histograms for the orders in the store.
+    `processed` remembers which chat messages were applied (apply_message)
+    and is persisted by the backend along with the orders. `stale` queues
+    the deadline of every order in a status with a time limit (overdue()),
+    and `updates` counts status updates by (agent, status) since load(),
+    for digests that report the difference between two readings.
+
+    Each method applies its event without awaiting, so it is atomic on the
+    event loop. Handlers that read orders, await, and then write must
+    check again what they read before writing (see /done).
+
+    Order dicts are never changed in place: an event replaces the entries
+    it touches. snapshot() can therefore hand out a shallow copy of the
+    orders that stays as it was, cached until the next event. The
+    backends and the archive write from it on `writer`'s thread.
+    """
+
+    def __init__(self, backend, agents_file: str, verify: bool = False,
+                 processed: ProcessedMessages = None, stale: StaleOrders = None):
+        self.backend = backend
+        self.verify = verify
+        self.processed = ProcessedMessages() if processed is None else processed
+        self.stale = StaleOrders() if stale is None else stale
+        self.updates = {}
+        self.writer = FileWriter()
+        self.stats = Aggregate()
+        self.latency = LatencyStats()
+        self.agents_file = agents_file
+        self.orders = {}
+        self.agents = AgentRegistry()
+        self._by_agent = {}
+        self._by_agent_id = {}
+        self._by_status = {}
+        self._rank = {}
+        self.seq = 0
+        self.version = 0
+        self._snapshot = (None, {})
+
+    def load(self):
+        self.orders = {}
+        self.seq = 0
+        self.updates = {}
+        self.processed.clear()
+        with timed("storage", op="load"):
+            self.backend.load(self)
+        self.seq = max(self.seq, upgrade_orders(self.orders))
+        self.agents.load(read_json(self.agents_file))
+        self._assign_agent_ids()
+        self._reindex()
+        self.version += 1
+
+    def flush(self):
+        with timed("storage", op="flush"):
+            self.backend.flush(self)
+            if self.agents.dirty:
+                self.writer.write_json(self.agents_file, self.agents.dump())
+                self.agents.dirty = False
+
+    def close(self):
+        self.flush()
+        self.backend.close(self)
+        self.writer.close()
+
+    def snapshot(self) -> dict:
+        """The orders as of now, in a dict that later events leave alone."""
+        version, orders = self._snapshot
+        if version != self.version:
+            orders = dict(self.orders)
+            self._snapshot = (self.version, orders)
+        return orders
+
+    # --- orders ---
+    def get(self, oid: str):
+        return self.orders.get(oid)
+
+    def __contains__(self, oid: str) -> bool:
+        return oid in self.orders
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def items(self):
+        return self.orders.items()
+
+    def values(self):
+        return self.orders.values()
+
+    async def find(self, agent: str = None, status: str = None, exclude_status: str = None,
+                   agent_id: int = None) -> list:
+        """Order IDs matching the given agent (by name or user ID) and/or current status."""
+        select = getattr(self.backend, "select", None)
+        if select is not None:
+            return await select(agent=agent, agent_id=agent_id, status=status, exclude_status=exclude_status)
+
+        if agent is not None or agent_id is not None:
+            if agent_id is not None:
+                ids = self._by_agent_id.get(agent_id, set())
+            else:
+                ids = self._by_agent.get(agent, set())
+            if status is not None:
+                ids = ids & self._by_status.get(status, set())
+        elif status is not None:
+            ids = self._by_status.get(status, set())
+        else:
+            ids = set().union(*(
+                bucket for key, bucket in self._by_status.items() if key != exclude_status
+            ))
+        if exclude_status is not None:
+            ids = ids - self._by_status.get(exclude_status, set())
+
+        return sorted(ids, key=self._rank.__getitem__)
+
+    def overdue(self, now: float = None) -> list:
+        """(oid, info) of orders that stayed in a status past its limit since the last call."""
+        return self.stale.due(self.orders, time.time() if now is None else now)
+
+    def apply_status(self, orders: list, status_full: str, agent_name: str, agent_id: int = None,
+                     msg: str = None, msg_orders: list = None) -> list:
+        """Apply a status to a list of order IDs. Returns list of updated IDs.
+
+        With `msg`, the message is also marked processed as naming `msg_orders`.
+        """
+        event = {
+            "op": "status",
+            "ids": orders,
+            "status": status_full,
+            "agent": agent_name,
+            "ts": int(time.time()),
+            "order_seq": self.seq + 1,
+        }
+        if agent_id is not None:
+            event["agent_id"] = agent_id
+        if msg is not None:
+            event["msg"] = msg
+            event["msg_orders"] = list(orders if msg_orders is None else msg_orders)
+        updated = self._apply_status(event)
+        self._check()
+        if updated or msg is not None:
+            self._record({**event, "ids": updated})
+        return updated
+
+    def apply_message(self, msg: str, orders: list, status_full: str, agent_name: str, agent_id: int = None,
+                      edited: bool = False) -> list:
+        """apply_status() for the orders named in one chat message, once per message.
+
+        A message that is already in `processed` changes nothing. An edit of
+        one applies only the difference: the orders it added, or all of its
+        orders if the status changed. Orders dropped by the edit are left
+        as they are. An order named twice in the message is applied once.
+        """
+        orders = list(dict.fromkeys(orders))
+        seen = self.processed.get(msg)
+        if seen is None:
+            todo = orders
+        elif not edited:
+            return []
+        else:
+            _, old_status, old_orders = seen
+            if old_status == status_full:
+                todo = [oid for oid in orders if oid not in old_orders]
+            else:
+                todo = orders
+        return self.apply_status(todo, status_full, agent_name, agent_id=agent_id, msg=msg, msg_orders=orders)
+
+    def revert(self, oid: str) -> bool:
+        """Undo a completed order back to its last non-done status."""
+        if oid not in self.orders:
+            return False
+        event = {"op": "undone", "id": oid, "ts": int(time.time()), "order_seq": self.seq + 1}
+        self._revert(event)
+        self._check()
+        self._record(event)
+        return True
+
+    def clear(self):
+        """Drop all orders (daily rollover)."""
+        self.orders = {}
+        self._reindex()
+        self._record({"op": "clear"})
+
+    def reset(self):
+        """Drop all orders and agents."""
+        self.clear()
+        self.agents.clear()
+
+    def _record(self, event: dict):
+        self.version += 1
+        with timed("storage", op="record"):
+            self.backend.record(self, event)
+
+    def replay(self, event: dict):
+        op = event["op"]
+        if isinstance(event.get("ts"), str):
+            # Journalled before events carried epoch times.
+            event = {**event, "ts": _legacy_ts(event["ts"], datetime.now(GMT5)), "order_seq": self.seq + 1}
+        if op == "status":
+            self._apply_status(event)
+        elif op == "undone":
+            self._revert(event)
+        elif op == "clear":
+            self.orders = {}
+            self._reindex()
+
+    # --- indexes ---
+    def _index(self, oid: str, info: dict):
+        self._by_agent.setdefault(info.get("agent"), set()).add(oid)
+        self._by_status.setdefault(info.get("status"), set()).add(oid)
+        if info.get("agent_id") is not None:
+            self._by_agent_id.setdefault(info["agent_id"], set()).add(oid)
+        self.stats.add(info)
+        self.stale.push(oid, info)
+
+    def _unindex(self, oid: str, info: dict):
+        for index, key in (
+            (self._by_agent, info.get("agent")),
+            (self._by_agent_id, info.get("agent_id")),
+            (self._by_status, info.get("status")),
+        ):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(oid)
+                if not bucket:
+                    del index[key]
+        self.stats.remove(info)
+
+    def _reindex(self):
+        self._by_agent, self._by_agent_id, self._by_status, self._rank = {}, {}, {}, {}
+        self.stats.clear()
+        self.latency.clear()
+        self.stale.clear()
+        for oid, info in self.orders.items():
+            self._rank[oid] = len(self._rank)
+            self._index(oid, info)
+            history = [unpack_entry(h) for h in info.get("history", [])]
+            for (_, ts_a, status_a, _), (_, ts_b, status_b, agent_b) in zip(history, history[1:]):
+                self.latency.observe((ts_a, status_a, None), (ts_b, status_b, agent_b))
+
+    def _check(self):
+        if self.verify:
+            self.stats.verify(self.orders)
+
+    def _apply_status(self, event: dict) -> list:
+        updated = []
+        status_full = event["status"]
+        agent_name = event["agent"]
+        agent_id = event.get("agent_id")
+        ts = event["ts"]
+        seq = event["order_seq"]
+
+        for oid in event["ids"]:
+            previous = self.orders.get(oid, {})
+            if previous.get("status") == STATUS_MAP["done"]:
+                continue
+
+            if previous:
+                self._unindex(oid, previous)
+            else:
+                self._rank.setdefault(oid, len(self._rank))
+            history = previous.get("history", [])
+            if history:
+                _, ts_before, status_before, _ = unpack_entry(history[-1])
+                self.latency.observe((ts_before, status_before, None), (ts, status_full, agent_name))
+            current = {
+                **previous,
+                "status": status_full,
+                "agent": agent_name,
+                "agent_id": agent_id,
+                "ts": ts,
+                "seq": seq,
+                "history": [*history, make_entry(seq, ts, status_full, agent_name, agent_id)],
+            }
+            self.orders[oid] = current
+            self._index(oid, current)
+            updated.append(oid)
+            self.seq = max(self.seq, seq)
+            seq += 1
+
+        if updated:
+            key = (agent_name, status_full)
+            self.updates[key] = self.updates.get(key, 0) + len(updated)
+        if "msg" in event:
+            self.processed.add(event["msg"], ts, status_full, event["msg_orders"])
+        return updated
+
+    def _revert(self, event: dict):
+        info = self.orders.get(event["id"])
+        if info is None:
+            return
+
+        done_code = STATUS_CODE[STATUS_MAP["done"]]
+        last = next((h for h in reversed(info.get("history", [])) if h[2] != done_code), None)
+
+        self._unindex(event["id"], info)
+        if last:
+            seq, ts, status, agent = unpack_entry(last)
+            agent_id = entry_agent_id(last)
+            if agent_id is None:  # recorded before agent IDs
+                agent_id = self.agents.unique_names().get(agent)
+            info = {**info, "status": status, "agent": agent, "agent_id": agent_id, "ts": ts, "seq": seq}
+        else:
+            info = {
+                **info, "status": "Pending", "agent": "Unknown", "agent_id": None,
+                "ts": event["ts"], "seq": event["order_seq"],
+            }
+            self.seq = max(self.seq, event["order_seq"])
+        self.orders[event["id"]] = info
+        self._index(event["id"], info)
+
+    # --- agents ---
+    def remember_agent(self, user_id: int, name: str):
+        self.agents.remember(user_id, name)
+
+    def _assign_agent_ids(self):
+        """Give orders recorded before agent IDs were their agent's ID, where the name is unambiguous."""
+        ids = self.agents.unique_names()
+        for oid, info in self.orders.items():
+            if info.get("agent_id") is None and info.get("agent") in ids:
+                self.orders[oid] = {**info, "agent_id": ids[info["agent"]]}
+        assign = getattr(self.backend, "assign_agent_ids", None)
+        if assign is not None and ids:
+            assign(ids)
+
+
+def open_store(backend: str, data_file: str, agents_file: str, journal_file: str,
+               snapshot_file: str, compact_every: int, db_file: str,
+               processed_file: str = None, processed: ProcessedMessages = None,
+               stale: StaleOrders = None) -> OrderStore:
+    options = {"processed": processed, "stale": stale}
+    if backend == "json":
+        return OrderStore(JsonBackend(data_file, processed_file), agents_file, **options)
+    if backend == "journal":
+        backend = JournalBackend(snapshot_file, journal_file, compact_every, seed_file=data_file)
+        return OrderStore(backend, agents_file, **options)
+    if backend == "sqlite":
+        return OrderStore(SqliteBackend(db_file, seed_file=data_file), agents_file, **options)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,108 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+
+# ----------------------------
+# WEBHOOK SERVER
+# ----------------------------
+class WebhookServer:
+    """Receives updates that Telegram POSTs to `path` and queues them for the application.
+
+    A request is answered as soon as its update is on `app.update_queue`,
+    so handler time never delays Telegram's next delivery. Requests without
+    the right X-Telegram-Bot-Api-Secret-Token header are refused when a
+    `secret_token` is set. stop() closes the port, so Telegram keeps new
+    updates until the bot is back, and lets requests already being read
+    finish for up to `drain_timeout`; their updates are still queued for
+    the application to handle before it stops.
+    """
+
+    MAX_BODY = 1 << 20
+
+    def __init__(self, app, host: str, port: int, path: str, secret_token: str = None, drain_timeout: float = 10.0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.path = path.encode()
+        self.secret_token = secret_token.encode() if secret_token else None
+        self.drain_timeout = drain_timeout
+        self._server = None
+        self._requests = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        logger.info("Webhook listening on %s:%s%s", self.host, self.port, self.path.decode())
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        if self._requests:
+            _, late = await asyncio.wait(self._requests, timeout=self.drain_timeout)
+            for task in late:
+                task.cancel()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _accept(self, reader, writer):
+        task = asyncio.current_task()
+        self._requests.add(task)
+        try:
+            status = await self._handle(reader)
+            metrics.inc("webhook_requests_total", status=status.split()[0])
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            self._requests.discard(task)
+            writer.close()
+
+    async def _handle(self, reader) -> str:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        request_line, *header_lines = head[:-4].split(b"\r\n")
+        try:
+            method, target, _ = request_line.split(b" ", 2)
+        except ValueError:
+            return "400 Bad Request"
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+
+        if target.split(b"?")[0] != self.path:
+            return "404 Not Found"
+        if method != b"POST":
+            return "405 Method Not Allowed"
+        if self.secret_token and not hmac.compare_digest(headers.get(SECRET_HEADER, b""), self.secret_token):
+            return "403 Forbidden"
+        try:
+            length = int(headers.get(b"content-length", b""))
+        except ValueError:
+            return "411 Length Required"
+        if length < 0:
+            return "400 Bad Request"
+        if length > self.MAX_BODY:
+            return "413 Payload Too Large"
+
+        body = await asyncio.wait_for(reader.readexactly(length), 10)
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.app.bot) if isinstance(data, dict) else None
+        except (ValueError, TypeError, KeyError, AttributeError):
+            update = None
+        if update is None:
+            logger.warning("Ignoring malformed webhook body")
+            return "400 Bad Request"
+        await self.app.update_queue.put(update)
+        return "200 OK"